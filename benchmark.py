@@ -0,0 +1,334 @@
+"""urbs scaling benchmark on synthetic input data
+
+Generates input dicts of configurable size (sites, processes per site,
+transmission links, storages per site, timesteps), runs all stages from
+read_excel to report on them and appends the stage durations to a CSV file,
+so that timings can be compared across urbs revisions. Each row is labelled
+with the hash of urbs.py (see urbs.source_hash) and, if run from a git
+checkout, the current git revision.
+
+Usage:
+    python benchmark.py
+
+"""
+import coopr.environ
+import numpy as np
+import os
+import pandas as pd
+import platform
+import subprocess
+import time
+import urbs
+from coopr.opt.base import SolverFactory
+from datetime import datetime
+
+# INIT
+result_dir = 'results'
+result_file = os.path.join(result_dir, 'benchmark.csv')
+solver = 'glpk'
+
+# problem sizes: sites, processes (per site), transmissions (links),
+# storages (per site), timesteps
+cases = [
+    dict(sites=2, processes=4, transmissions=1, storages=1, timesteps=24),
+    dict(sites=3, processes=6, transmissions=3, storages=2, timesteps=168),
+    dict(sites=5, processes=6, transmissions=6, storages=2, timesteps=168),
+    dict(sites=5, processes=8, transmissions=8, storages=2, timesteps=720),
+    dict(sites=10, processes=8, transmissions=15, storages=2, timesteps=720)]
+
+# process templates (name, input commodity, commodity type); processes are
+# taken in this order and numbered once all templates are used
+PROCESS_TEMPLATES = [
+    ('wt', 'Wind', 'SupIm'),
+    ('pv', 'Solar', 'SupIm'),
+    ('gt', 'Gas', 'Stock'),
+    ('st', 'Coal', 'Stock'),
+    ('turb', 'Hydro', 'SupIm'),
+    ('pp', 'Biomass', 'Stock'),
+    ('st', 'Lignite', 'Stock')]
+
+# attribute values by input commodity:
+# inv-cost, fix-cost, var-cost, eff, co2, fuel price
+PROCESS_ATTRIBUTES = {
+    'Wind': (900000, 30000, 0, 1.00, 0.0, np.nan),
+    'Solar': (600000, 25000, 0, 1.00, 0.0, np.nan),
+    'Hydro': (1600000, 20000, 0, 1.00, 0.0, np.nan),
+    'Gas': (750000, 10000, 2.7, 0.60, 0.2, 27.0),
+    'Coal': (1500000, 45000, 1.5, 0.50, 0.3, 7.0),
+    'Lignite': (1500000, 45000, 1.5, 0.40, 0.4, 4.0),
+    'Biomass': (2500000, 80000, 4.0, 0.35, 0.0, 6.0),
+    'Slack': (0, 0, 999.0, 1.00, 0.0, 999.0)}
+
+
+# SYNTHETIC DATA
+def generate_data(sites=3, processes=6, transmissions=3, storages=2,
+                  timesteps=168, seed=0):
+    """Create a synthetic urbs input dict.
+
+    All sites have an electricity demand, the given number of processes
+    (plus one expensive slack power plant, which keeps every problem
+    feasible) and storages. Transmission links connect neighbouring sites
+    first (in a ring), then more distant ones, each in both directions.
+
+    Args:
+        sites: number of sites
+        processes: number of processes per site
+        transmissions: number of transmission links between two sites, at
+            most sites * (sites - 1) / 2
+        storages: number of storage technologies per site
+        timesteps: number of modelled timesteps; timeseries have one more
+            row for the initial timestep 0
+        seed: seed of the random number generator for the timeseries
+
+    Returns:
+        a dict of 6 DataFrames, like read_excel
+
+    Example:
+        >>> data = generate_data(sites=2, timesteps=24)
+        >>> model = urbs.create_model(data, range(25))
+    """
+    rand = np.random.RandomState(seed)
+    site_names = ['S{:02d}'.format(k) for k in range(sites)]
+
+    # processes and their commodities
+    process_rows = []
+    commodity_rows = [('Global', 'CO2', 'Env', np.nan, np.inf, np.nan)]
+    site_inputs = {}
+    for sit in site_names:
+        inputs = set()
+        for k in range(processes):
+            pro, coin, com_type = PROCESS_TEMPLATES[
+                k % len(PROCESS_TEMPLATES)]
+            if k >= len(PROCESS_TEMPLATES):
+                pro = '{}{}'.format(pro, k // len(PROCESS_TEMPLATES))
+            inv, fix, var, eff, co2, price = PROCESS_ATTRIBUTES[coin]
+            process_rows.append(
+                (sit, pro, coin, 'Elec', 0, 0, 100000, eff, inv, fix, var,
+                 0.07, 30, co2))
+            inputs.add((coin, com_type))
+        inputs.add(('Slack', 'Stock'))
+        site_inputs[sit] = inputs
+        process_rows.append(
+            (sit, 'pp', 'Slack', 'Elec', 999999, 999999, 999999, 1.0, 0, 0,
+             999.0, 0.07, 1, 0))
+
+        commodity_rows.append((sit, 'Elec', 'Demand', np.nan, np.nan, np.nan))
+        for coin, com_type in sorted(inputs):
+            if com_type == 'Stock':
+                commodity_rows.append((sit, coin, com_type,
+                                       PROCESS_ATTRIBUTES[coin][5],
+                                       np.inf, np.inf))
+            else:
+                commodity_rows.append(
+                    (sit, coin, com_type, np.nan, np.nan, np.nan))
+
+    commodity = pd.DataFrame(
+        commodity_rows,
+        columns=['Sit', 'Com', 'Type', 'price', 'max', 'maxperstep'])
+    process = pd.DataFrame(
+        process_rows,
+        columns=['Sit', 'Pro', 'CoIn', 'CoOut', 'inst-cap', 'cap-lo',
+                 'cap-up', 'eff', 'inv-cost', 'fix-cost', 'var-cost', 'wacc',
+                 'depreciation', 'co2'])
+
+    # transmission links: ring of neighbours first, then longer distances
+    links = [(site_names[i], site_names[(i + d) % sites])
+             for d in range(1, sites // 2 + 1)
+             for i in range(sites if 2 * d < sites else sites // 2)]
+    transmission_rows = []
+    for sin, sout in links[:transmissions]:
+        for a, b in [(sin, sout), (sout, sin)]:
+            transmission_rows.append(
+                (a, b, 'hvac', 'Elec', 0.9, 1650000, 16500, 0, 0, 0, np.inf,
+                 0.07, 40))
+    transmission = pd.DataFrame(
+        transmission_rows,
+        columns=['SitIn', 'SitOut', 'Tra', 'Com', 'eff', 'inv-cost',
+                 'fix-cost', 'var-cost', 'inst-cap', 'cap-lo', 'cap-up',
+                 'wacc', 'depreciation'])
+
+    # storage technologies, alternating between long- and short-term
+    storage_rows = []
+    for sit in site_names:
+        for k in range(storages):
+            if k % 2 == 0:
+                storage_rows.append(
+                    (sit, 'Pump storage {}'.format(k), 'Elec', 0, 0, np.inf,
+                     0, 0, np.inf, 0.88, 0.88, 100000, 0, 20000, 0, 0.02, 0,
+                     50, 0.07, 0.5))
+            else:
+                storage_rows.append(
+                    (sit, 'Hydrogen {}'.format(k), 'Elec', 0, 0, np.inf, 0,
+                     0, np.inf, 0.4, 0.4, 42000, 6.54, 0, 0.327, 0.02, 0,
+                     50, 0.07, 0.5))
+    storage = pd.DataFrame(
+        storage_rows,
+        columns=['Sit', 'Sto', 'Com', 'inst-cap-c', 'cap-lo-c', 'cap-up-c',
+                 'inst-cap-p', 'cap-lo-p', 'cap-up-p', 'eff-in', 'eff-out',
+                 'inv-cost-p', 'inv-cost-c', 'fix-cost-p', 'fix-cost-c',
+                 'var-cost-p', 'var-cost-c', 'depreciation', 'wacc', 'init'])
+
+    # timeseries: daily cycle plus noise; timestep 0 is all zeros
+    t = np.arange(timesteps + 1)
+    hour = t % 24
+    daily = np.sin(np.pi * (hour - 6) / 12)
+    demand = pd.DataFrame(index=pd.Index(t, name='t'))
+    supim = pd.DataFrame(index=pd.Index(t, name='t'))
+    for sit in site_names:
+        base = rand.uniform(5000, 50000)
+        demand[sit, 'Elec'] = base * (
+            1 + 0.25 * daily + 0.05 * rand.standard_normal(len(t)))
+        for coin, com_type in sorted(site_inputs[sit]):
+            if com_type != 'SupIm':
+                continue
+            if coin == 'Solar':
+                series = np.maximum(daily, 0) * rand.uniform(0.6, 1.0)
+            elif coin == 'Wind':
+                # weather fronts of a few days plus noise
+                period = 24 * rand.uniform(3, 7)
+                series = np.clip(
+                    0.4 + 0.3 * np.sin(2 * np.pi * t / period +
+                                       rand.uniform(0, 2 * np.pi)) +
+                    0.1 * rand.standard_normal(len(t)), 0, 1)
+            else:
+                series = np.clip(rand.uniform(0.3, 0.7) + 0.02 *
+                                 rand.standard_normal(len(t)), 0, 1)
+            supim[sit, coin] = series
+    demand.iloc[0] = 0
+    supim.iloc[0] = 0
+    demand.columns = pd.MultiIndex.from_tuples(demand.columns)
+    supim.columns = pd.MultiIndex.from_tuples(supim.columns)
+
+    commodity.set_index(['Sit', 'Com', 'Type'], inplace=True)
+    process.set_index(['Sit', 'Pro', 'CoIn', 'CoOut'], inplace=True)
+    transmission.set_index(['SitIn', 'SitOut', 'Tra', 'Com'], inplace=True)
+    storage.set_index(['Sit', 'Sto', 'Com'], inplace=True)
+
+    # derive annuity factor and sort, like read_excel
+    for df in [process, transmission, storage]:
+        df['annuity-factor'] = urbs.annuity_factor(
+            df['depreciation'], df['wacc'])
+    data = {
+        'commodity': commodity,
+        'process': process,
+        'transmission': transmission,
+        'storage': storage,
+        'demand': demand,
+        'supim': supim}
+    for key in data:
+        if isinstance(data[key].index, pd.core.index.MultiIndex):
+            data[key].sortlevel(inplace=True)
+    return data
+
+
+def write_excel(data, filename):
+    """Write input dict to a spreadsheet that read_excel can read.
+
+    Args:
+        data: input dict, e.g. from generate_data
+        filename: Excel spreadsheet filename
+
+    Returns:
+        Nothing
+    """
+    with pd.ExcelWriter(filename) as writer:
+        for key, sheet in [('commodity', 'Commodity'), ('process', 'Process'),
+                           ('transmission', 'Transmission'),
+                           ('storage', 'Storage')]:
+            table = data[key][[column for column in data[key].columns
+                               if column != 'annuity-factor']]
+            table.reset_index().to_excel(writer, sheet, index=False)
+        for key, sheet in [('demand', 'Demand'), ('supim', 'SupIm')]:
+            table = data[key].copy()
+            table.columns = ['.'.join(column) for column in table.columns]
+            table.to_excel(writer, sheet)
+
+
+# BENCHMARK
+def run_benchmark(case, solver='glpk', result_dir='results'):
+    """Run all urbs stages on synthetic data of one problem size.
+
+    Args:
+        case: dict of keyword arguments to generate_data
+        solver: solver name for SolverFactory
+        result_dir: directory for temporary spreadsheet and report
+
+    Returns:
+        dict of problem size, stage durations in seconds and objective value
+    """
+    data = generate_data(**case)
+    timesteps = range(case.get('timesteps', 168) + 1)
+    input_file = os.path.join(result_dir, 'benchmark-input.xlsx')
+    report_file = os.path.join(result_dir, 'benchmark-report.xlsx')
+    write_excel(data, input_file)
+    row = dict(case)
+    stage_start = [time.time()]
+
+    def stage(name):
+        now = time.time()
+        row[name] = now - stage_start[0]
+        stage_start[0] = now
+
+    try:
+        data = urbs.read_excel(input_file)
+        stage('read_excel')
+        model = urbs.create_model(data, timesteps)
+        stage('create_model')
+        prob = model.create()
+        stage('create')
+        optim = SolverFactory(solver)
+        result = optim.solve(prob)
+        prob.load(result)
+        stage('solve')
+        urbs.get_constants(prob)
+        stage('get_constants')
+        sites = sorted(set(sit for sit, com in prob.demand.columns))
+        for sit in sites:
+            urbs.get_timeseries(prob, 'Elec', sit)
+        stage('get_timeseries')
+        urbs.report(prob, report_file, ['Elec'], sites)
+        stage('report')
+        row['objective'] = urbs.get_entity(prob, 'costs')['costs'].sum()
+    finally:
+        for filename in [input_file, report_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+    return row
+
+
+def git_revision():
+    """Return short hash of the checked out git revision, '' if unknown."""
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(urbs.__file__)),
+            stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return revision.decode('ascii').strip()
+
+
+# MAIN
+if __name__ == '__main__':
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+
+    rows = []
+    for case in cases:
+        print('Benchmark {}'.format(case))
+        rows.append(run_benchmark(case, solver, result_dir))
+
+    results = pd.DataFrame(rows)
+    results['version'] = urbs.__version__
+    results['source'] = urbs.source_hash()[:8]
+    results['revision'] = git_revision()
+    results['date'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+    results['host'] = platform.node()
+    results['solver'] = solver
+    print(results)
+
+    # append to earlier results, to compare timings across revisions
+    if os.path.exists(result_file):
+        results = pd.concat([pd.read_csv(result_file), results],
+                            ignore_index=True)
+    results.to_csv(result_file, index=False)
@@ -0,0 +1,225 @@
+"""urbs command-line interface
+
+Runs, reports, plots, compares and validates urbs scenarios without editing
+a script. Heavy modules (pandas via urbs, coopr, matplotlib) are only
+imported by the subcommands that need them, so that ``--help`` and
+``validate`` start quickly.
+
+Usage:
+    python cli.py run data-example.xlsx --timesteps 4000:4121 \\
+        --scenarios scenarios:scenario_co2_limit scenarios:scenario_base
+    python cli.py report data-example.xlsx -t 4000:4121 -s scenarios
+    python cli.py compare --result-dir results
+    python cli.py validate data-example.xlsx -t 4000:4121
+
+"""
+import argparse
+import importlib
+import os
+import sys
+
+
+def scenario_base(data):
+    # do nothing
+    return data
+
+
+def parse_timesteps(window):
+    """Convert a 'START:STOP' string to the list range(START, STOP).
+
+    Like runme.py, the first timestep is the initial state only, so
+    '4000:4121' models the 120 timesteps 4001 to 4120.
+    """
+    try:
+        start, stop = (int(step) for step in window.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "timestep window must be START:STOP, not '{}'".format(window))
+    return list(range(start, stop))
+
+
+def load_scenarios(specs):
+    """Import scenarios from 'module:name' or 'module' specifications.
+
+    A bare module name selects all module-level scenarios of that module,
+    i.e. functions and Scenario objects whose name starts with 'scenario_'.
+    Modules are looked up in the current directory first. They are imported,
+    so scripts must guard their main code by ``if __name__ == '__main__':``.
+
+    Args:
+        specs: list of scenario specifications; if empty, only the
+            unmodified base scenario is run
+
+    Returns:
+        list of scenario functions or Scenario objects
+    """
+    if not specs:
+        return [scenario_base]
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+
+    scenarios = []
+    for spec in specs:
+        module_name, _, name = spec.partition(':')
+        module = importlib.import_module(module_name)
+        if name:
+            scenarios.append(getattr(module, name))
+        else:
+            scenarios.extend(
+                getattr(module, name) for name in sorted(vars(module))
+                if name.startswith('scenario_') and
+                callable(getattr(module, name)))
+    return scenarios
+
+
+def get_timesteps(args):
+    """Return timesteps of args, default: all timesteps of the input."""
+    if args.timesteps is not None:
+        return args.timesteps
+    import urbs
+    data = urbs.read_excel(args.input, cache_dir=args.cache_dir)
+    return list(data['demand'].index)
+
+
+def run(args, report_format=None, plot_formats=None):
+    """Run subcommands run, report and plot; return exit code."""
+    import urbs
+
+    if report_format is None:
+        report_format = args.report_format
+    if plot_formats is None:
+        plot_formats = args.plot_formats
+
+    summary = urbs.run_scenarios(
+        args.input, load_scenarios(args.scenarios), get_timesteps(args),
+        workers=args.workers, dt=args.dt, solver=args.solver,
+        result_dir=args.result_dir, report_format=report_format,
+        plot_formats=plot_formats, cache_dir=args.cache_dir,
+        profile=args.profile, database=args.database,
+        solve_cache=args.solve_cache)
+
+    print(summary.drop('error', axis=1).to_string())
+    for sce in summary.index[summary['status'] != 'ok']:
+        print('\n{} failed:\n{}'.format(sce, summary.loc[sce, 'error']))
+    return 0 if (summary['status'] == 'ok').all() else 1
+
+
+def compare(args):
+    """Run subcommand compare; return exit code."""
+    import comp
+
+    costs, esums = comp.compare(args.result_dir, args.output, args.pattern,
+                                args.plot_formats, args.database)
+    print(costs.to_string())
+    return 0
+
+
+def validate(args):
+    """Run subcommand validate; return exit code."""
+    import urbs
+
+    data = urbs.read_excel(args.input, cache_dir=args.cache_dir,
+                           timesteps=args.timesteps)
+    timesteps = args.timesteps
+    if timesteps is None:
+        timesteps = list(data['demand'].index)
+
+    problems = urbs.validate(data, timesteps)
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print('{}: ok ({} timesteps)'.format(args.input, len(timesteps) - 1))
+    return 0
+
+
+def main(argv=None):
+    """Parse command-line arguments and run the chosen subcommand.
+
+    Args:
+        argv: list of arguments (default: sys.argv[1:])
+
+    Returns:
+        exit code, 0 on success
+    """
+    # options shared by all subcommands that read an input file
+    model = argparse.ArgumentParser(add_help=False)
+    model.add_argument('input', help='input spreadsheet, e.g. '
+                       'data-example.xlsx')
+    model.add_argument('-t', '--timesteps', type=parse_timesteps,
+                       help='timestep window START:STOP (default: all)')
+    model.add_argument('--dt', type=float, default=1,
+                       help='timestep duration in hours (default: 1)')
+    model.add_argument('--cache-dir',
+                       help='directory for cached input (see read_excel)')
+
+    # options shared by run, report and plot
+    solve = argparse.ArgumentParser(add_help=False, parents=[model])
+    solve.add_argument('-s', '--scenarios', nargs='+', default=[],
+                       metavar='MODULE[:NAME]',
+                       help='scenarios to run (default: base scenario)')
+    solve.add_argument('--solver', default='glpk',
+                       help='solver name (default: glpk)')
+    solve.add_argument('-o', '--result-dir', default='results',
+                       help='output directory (default: results)')
+    solve.add_argument('-j', '--workers', type=int,
+                       help='worker processes (default: number of CPUs)')
+    solve.add_argument('--report-format', default='xlsx',
+                       choices=['xlsx', 'h5'],
+                       help='report file format (default: xlsx)')
+    solve.add_argument('--plot-formats', nargs='+', default=['png', 'pdf'],
+                       metavar='EXT',
+                       help='figure file formats (default: png pdf)')
+    solve.add_argument('--profile', action='store_true',
+                       help='save model build profile as CSV')
+    solve.add_argument('--database',
+                       help='also add report tables to this SQLite database')
+    solve.add_argument('--solve-cache', metavar='DIR',
+                       help='reuse solutions of unchanged scenarios from '
+                       'this directory')
+
+    parser = argparse.ArgumentParser(
+        prog='urbs', description='urbs: A linear optimisation model for '
+        'distributed energy systems')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser(
+        'run', parents=[solve], help='solve scenarios, write reports and '
+        'plots')
+    subparser.set_defaults(func=run)
+    subparser = subparsers.add_parser(
+        'report', parents=[solve], help='solve scenarios, write reports only')
+    subparser.set_defaults(func=lambda args: run(args, plot_formats=()))
+    subparser = subparsers.add_parser(
+        'plot', parents=[solve], help='solve scenarios, write plots only')
+    subparser.set_defaults(func=lambda args: run(args, report_format=''))
+
+    subparser = subparsers.add_parser(
+        'compare', help='compare costs and energy sums of scenario reports')
+    subparser.add_argument('-o', '--result-dir', default='results',
+                           help='directory of reports (default: results)')
+    subparser.add_argument('--output', help='output basename (default: '
+                           'comp in result directory)')
+    subparser.add_argument('--pattern', default='scenario_*',
+                           help='report basename pattern (default: '
+                           'scenario_*)')
+    subparser.add_argument('--database',
+                           help='query results from this SQLite database '
+                           'instead of report files')
+    subparser.add_argument('--plot-formats', nargs='+',
+                           default=['png', 'pdf'], metavar='EXT',
+                           help='figure file formats (default: png pdf)')
+    subparser.set_defaults(func=compare)
+
+    subparser = subparsers.add_parser(
+        'validate', parents=[model], help='check input file and timestep '
+        'window without building a model')
+    subparser.set_defaults(func=validate)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
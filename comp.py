@@ -1,120 +1,260 @@
 import glob
-import matplotlib.gridspec as gs
-import matplotlib.pyplot as plt
-import matplotlib.ticker as tkr
 import os
 import pandas as pd
+import re
+import sqlite3
 import urbs
 
-# INIT
+# run timestamp appended to report filenames by runme.py and run_scenario
+TIMESTAMP_SUFFIX = r'_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}$'
 
-# create list of report files to compare
-# derive list of scenario names for column labels/figure captions
-result_files = sorted(glob.glob(os.path.join('results', 'scenario_*.xlsx')))
-scenario_names = [os.path.basename(rf)
-                  .replace('_', ' ')
-                  .replace('.xlsx', '')
-                  .replace('scenario ', '')
-                  for rf in result_files]
-# output files basename (without file extension)
-output_filename = os.path.join('results', 'comp')
 
-# find base scenario and put at first position
-base_scenario = scenario_names.index('base')
-result_files.insert(0, result_files.pop(base_scenario))
-scenario_names.insert(0, scenario_names.pop(base_scenario))
+def find_result_files(result_dir='results', pattern='scenario_*'):
+    """Find report files (Excel or HDF5) and derive their scenario names.
 
-costs = []  # total costs by type and scenario
-esums = []  # sum of energy produced by scenario
+    Args:
+        result_dir: directory containing the report files
+        pattern: glob pattern of report basenames (without extension)
 
-# READ
+    Returns:
+        (result_files, scenario_names) tuple of lists, base scenario first
+    """
+    # create list of report files (Excel or HDF5) to compare, keeping only
+    # the latest report per scenario if filenames carry a run timestamp
+    reports = {}
+    candidates = glob.glob(os.path.join(result_dir, pattern + '.xlsx'))
+    for ext in urbs.HDF_EXTENSIONS:
+        candidates += glob.glob(os.path.join(result_dir, pattern + ext))
+    for rf in sorted(candidates, key=os.path.getmtime):
+        basename = os.path.splitext(os.path.basename(rf))[0]
+        reports[re.sub(TIMESTAMP_SUFFIX, '', basename)] = rf
 
-for rf in result_files:
-    with pd.ExcelFile(rf) as xls:
-        cost = xls.parse('Costs', has_index_names=True)
-        esum = xls.parse('Energy sums')
+    # derive list of scenario names for column labels/figure captions
+    scenarios = sort_scenarios(reports)
+    result_files = [reports[sce] for sce in scenarios]
+    scenario_names = [scenario_name(sce) for sce in scenarios]
+    return result_files, scenario_names
 
-        # repair broken MultiIndex in the first column
-        esum.reset_index(inplace=True)
-        esum.fillna(method='ffill', inplace=True)
-        esum.set_index(['level_0', 'level_1'], inplace=True)
+
+def scenario_name(scenario):
+    """Return label of scenario, e.g. 'co2 limit' for 'scenario_co2_limit'."""
+    return scenario.replace('_', ' ').replace('scenario ', '')
+
+
+def sort_scenarios(scenarios):
+    """Sort scenarios by name, but put the base scenario first."""
+    return sorted(scenarios, key=lambda sce: (scenario_name(sce) != 'base',
+                                              sce))
+
+
+def read_results(result_files, scenario_names):
+    """Read costs and energy sums of report files into comparison tables.
+
+    Args:
+        result_files: list of report filenames
+        scenario_names: list of scenario names, one per report file
+
+    Returns:
+        (costs, esums) tuple of DataFrames with scenarios as index, costs by
+        type in 1e9 EUR/a and created energy by commodity in GWh
+    """
+    costs = []  # total costs by type and scenario
+    esums = []  # sum of energy produced by scenario
+
+    # READ
+
+    for rf in result_files:
+        if rf.endswith(urbs.HDF_EXTENSIONS):
+            # HDF5 reports store both tables with their proper index
+            cost = pd.read_hdf(rf, 'costs')
+            esum = pd.read_hdf(rf, 'energy_sums')
+            esum.index.names = ['level_0', 'level_1']
+        else:
+            with pd.ExcelFile(rf) as xls:
+                cost = xls.parse('Costs', has_index_names=True)
+                esum = xls.parse('Energy sums')
+
+                # repair broken MultiIndex in the first column
+                esum.reset_index(inplace=True)
+                esum.fillna(method='ffill', inplace=True)
+                esum.set_index(['level_0', 'level_1'], inplace=True)
 
         costs.append(cost)
         esums.append(esum)
 
-# merge everything into one DataFrame each
-costs = pd.concat(costs, axis=1, keys=scenario_names)
-esums = pd.concat(esums, axis=1, keys=scenario_names)
-
-# ANALYSE
-
-# drop redundant 'costs' column label
-# make index name nicer for plot
-# sort/transpose frame
-# convert EUR/a to 1e9 EUR/a
-costs.columns = costs.columns.droplevel(1)
-costs.index.name = 'Cost type'
-costs = costs.sort().transpose()
-costs = costs / 1e9
-
-# sum up created energy over all locations, but keeping scenarios (level=0)
-# make index name 'Commodity' nicer for plot
-# drop all unused commodities and sort/transpose
-# convert MWh to GWh
-esums = esums.loc['Created'].sum(axis=1, level=0)
-esums.index.name = 'Commodity'
-used_commodities = (esums.sum(axis=1) > 0)
-esums = esums[used_commodities].sort().transpose()
-esums = esums / 1e3
-
-
-# PLOT
-
-fig = plt.figure(figsize=(20, 8))
-gs = gs.GridSpec(1, 2, width_ratios=[2, 3])
-
-ax0 = plt.subplot(gs[0])
-bp0 = costs.plot(ax=ax0, kind='barh', stacked=True)
-
-ax1 = plt.subplot(gs[1])
-esums_colors = [urbs.to_color(commodity) for commodity in esums.columns]
-bp1 = esums.plot(ax=ax1, kind='barh', stacked=True, color=esums_colors)
-
-# remove scenario names from second plot
-ax1.set_yticklabels('')
-
-# make bar plot edges lighter
-for bp in [bp0, bp1]:
-    for patch in bp.patches:
-        patch.set_edgecolor(urbs.to_color('Decoration'))
-
-# set limits and ticks for both axes
-for ax in [ax0, ax1]:
-    plt.setp(ax.spines.values(), color=urbs.to_color('Grid'))
-    ax.yaxis.grid(False)
-    ax.xaxis.grid(True, 'major', color=urbs.to_color('Grid'), linestyle='-')
-    ax.xaxis.set_ticks_position('none')
-    ax.yaxis.set_ticks_position('none')
-    
-    # group 1,000,000 with commas
-    group_thousands = tkr.FuncFormatter(lambda x, pos: '{:0,d}'.format(int(x)))
-    ax.xaxis.set_major_formatter(group_thousands)
-
-    # legend
-    lg = ax.legend(frameon=False, loc='upper center',
-                   ncol=len(ax.legend().get_texts()),
-                   bbox_to_anchor=(0.5, 1.08))
-    plt.setp(lg.get_patches(), edgecolor=urbs.to_color('Decoration'),
-             linewidth=0.15)
-
-ax0.set_xlabel('Total costs (1e9 EUR/a)')
-ax1.set_xlabel('Total energy produced (GWh)')
-
-for ext in ['png', 'pdf']:
-    fig.savefig('{}.{}'.format(output_filename, ext),
-                bbox_inches='tight')
-
-# REPORT
-with pd.ExcelWriter('{}.{}'.format(output_filename, 'xlsx')) as writer:
-    costs.to_excel(writer, 'Costs')
-    esums.to_excel(writer, 'Energy sums')
+    # merge everything into one DataFrame each
+    costs = pd.concat(costs, axis=1, keys=scenario_names)
+    esums = pd.concat(esums, axis=1, keys=scenario_names)
+
+    # ANALYSE
+
+    # drop redundant 'costs' column label
+    # make index name nicer for plot
+    # sort/transpose frame
+    # convert EUR/a to 1e9 EUR/a
+    costs.columns = costs.columns.droplevel(1)
+    costs.index.name = 'Cost type'
+    costs = costs.sort().transpose()
+    costs = costs / 1e9
+
+    # sum up created energy over all locations, but keeping scenarios
+    # (level=0); make index name 'Commodity' nicer for plot
+    # drop all unused commodities and sort/transpose
+    # convert MWh to GWh
+    esums = esums.loc['Created'].sum(axis=1, level=0)
+    esums.index.name = 'Commodity'
+    used_commodities = (esums.sum(axis=1) > 0)
+    esums = esums[used_commodities].sort().transpose()
+    esums = esums / 1e3
+    return costs, esums
+
+
+def read_results_sql(database, pattern='scenario_*'):
+    """Read costs and energy sums from a SQLite result store.
+
+    Like read_results, but queries the latest run of each scenario from a
+    database written by urbs.report_sql, instead of reading report files.
+
+    Args:
+        database: SQLite database filename
+        pattern: glob pattern of scenario names
+
+    Returns:
+        (costs, esums) tuple of DataFrames, see read_results
+    """
+    # latest run of each matching scenario
+    latest = ("JOIN (SELECT scenario, MAX(run) AS run FROM costs "
+              "WHERE scenario GLOB ? GROUP BY scenario) AS latest "
+              "USING (scenario, run)")
+
+    con = sqlite3.connect(database)
+    try:
+        costs = pd.read_sql_query(
+            "SELECT scenario, cost_type, value FROM costs " + latest,
+            con, params=(pattern,))
+        esums = pd.read_sql_query(
+            "SELECT scenario, name, SUM(value) AS value FROM energy_sums " +
+            latest + " WHERE type = 'Created' GROUP BY scenario, name",
+            con, params=(pattern,))
+    finally:
+        con.close()
+    if costs.empty:
+        raise ValueError("No scenario matching '{}' in {}".format(
+            pattern, database))
+
+    # one row per scenario, base scenario first; convert EUR/a to
+    # 1e9 EUR/a and MWh to GWh
+    scenarios = sort_scenarios(costs['scenario'].unique())
+    costs = costs.pivot(index='scenario', columns='cost_type',
+                         values='value').fillna(0)
+    costs = costs.reindex(scenarios).sort_index(axis=1) / 1e9
+    costs.index = [scenario_name(sce) for sce in scenarios]
+    costs.columns.name = 'Cost type'
+
+    # drop all unused commodities
+    esums = esums.pivot(index='scenario', columns='name', values='value')
+    esums = esums.reindex(scenarios).fillna(0).sort_index(axis=1) / 1e3
+    esums = esums.loc[:, esums.sum() > 0]
+    esums.index = [scenario_name(sce) for sce in scenarios]
+    esums.columns.name = 'Commodity'
+    return costs, esums
+
+
+def plot_comparison(costs, esums, output_filename, formats=('png', 'pdf')):
+    """Plot costs and energy sums of all scenarios as stacked bar charts.
+
+    Args:
+        costs, esums: DataFrames as returned by read_results
+        output_filename: output files basename (without file extension)
+        formats: figure file extensions
+    """
+    import matplotlib.gridspec as gs
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as tkr
+
+    # PLOT
+
+    fig = plt.figure(figsize=(20, 8))
+    gs = gs.GridSpec(1, 2, width_ratios=[2, 3])
+
+    ax0 = plt.subplot(gs[0])
+    bp0 = costs.plot(ax=ax0, kind='barh', stacked=True)
+
+    ax1 = plt.subplot(gs[1])
+    esums_colors = [urbs.to_color(commodity) for commodity in esums.columns]
+    bp1 = esums.plot(ax=ax1, kind='barh', stacked=True, color=esums_colors)
+
+    # remove scenario names from second plot
+    ax1.set_yticklabels('')
+
+    # make bar plot edges lighter
+    for bp in [bp0, bp1]:
+        for patch in bp.patches:
+            patch.set_edgecolor(urbs.to_color('Decoration'))
+
+    # set limits and ticks for both axes
+    for ax in [ax0, ax1]:
+        plt.setp(ax.spines.values(), color=urbs.to_color('Grid'))
+        ax.yaxis.grid(False)
+        ax.xaxis.grid(True, 'major', color=urbs.to_color('Grid'),
+                      linestyle='-')
+        ax.xaxis.set_ticks_position('none')
+        ax.yaxis.set_ticks_position('none')
+
+        # group 1,000,000 with commas
+        group_thousands = tkr.FuncFormatter(
+            lambda x, pos: '{:0,d}'.format(int(x)))
+        ax.xaxis.set_major_formatter(group_thousands)
+
+        # legend
+        lg = ax.legend(frameon=False, loc='upper center',
+                       ncol=len(ax.legend().get_texts()),
+                       bbox_to_anchor=(0.5, 1.08))
+        plt.setp(lg.get_patches(), edgecolor=urbs.to_color('Decoration'),
+                 linewidth=0.15)
+
+    ax0.set_xlabel('Total costs (1e9 EUR/a)')
+    ax1.set_xlabel('Total energy produced (GWh)')
+
+    for ext in formats:
+        fig.savefig('{}.{}'.format(output_filename, ext),
+                    bbox_inches='tight')
+    plt.close(fig)
+
+
+def compare(result_dir='results', output_filename=None, pattern='scenario_*',
+            plot_formats=('png', 'pdf'), database=None):
+    """Compare all scenario reports in result_dir in one plot and sheet.
+
+    Args:
+        result_dir: directory containing the report files
+        output_filename: output files basename (without file extension);
+            default: 'comp' in result_dir
+        pattern: glob pattern of report basenames (without extension)
+        plot_formats: figure file extensions; if empty, no plot is created
+        database: optional SQLite result store (see urbs.report_sql); if
+            given, results are queried from it instead of the report files
+
+    Returns:
+        (costs, esums) tuple of DataFrames, see read_results
+    """
+    if output_filename is None:
+        output_filename = os.path.join(result_dir, 'comp')
+
+    if database is not None:
+        costs, esums = read_results_sql(database, pattern)
+    else:
+        result_files, scenario_names = find_result_files(result_dir, pattern)
+        costs, esums = read_results(result_files, scenario_names)
+    if plot_formats:
+        plot_comparison(costs, esums, output_filename, plot_formats)
+
+    # REPORT
+    with pd.ExcelWriter('{}.{}'.format(output_filename, 'xlsx')) as writer:
+        costs.to_excel(writer, 'Costs')
+        esums.to_excel(writer, 'Energy sums')
+    return costs, esums
+
+
+if __name__ == '__main__':
+    compare('results')
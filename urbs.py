@@ -9,12 +9,33 @@ transporting commodities between sites and storage for saving/retrieving
 commodities.
 
 """
-import coopr.pyomo as pyomo
+import hashlib
+import multiprocessing
+import numpy as np
+import os
 import pandas as pd
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
 from datetime import datetime
+from functools import partial
 from operator import itemgetter
 from random import random
 
+__version__ = '0.2'
+
+# coopr.pyomo, imported on first use by _import_pyomo to keep 'import urbs'
+# (and the command-line interface cli.py) fast
+pyomo = None
+ProfilingModel = None
+
+# hash of this file, computed on first use by source_hash
+_source_hash = None
+
 COLORS = {
     'Biomass': (0, 122, 55),
     'Coal': (100, 100, 100),
@@ -36,8 +57,104 @@ COLORS = {
     'Decoration': (128, 128, 128),
     'Grid': (128, 128, 128)}
 
-
-def read_excel(filename):
+# file extensions for which report writes HDF5 instead of Excel files
+HDF_EXTENSIONS = ('.h5', '.hdf5')
+
+# cost types, cf. def_costs_rule in create_model
+COST_TYPES = ['Inv', 'Fix', 'Var', 'Fuel']
+
+# variables that compact mode of create_model leaves out
+DERIVED_ENTITIES = ['cap_pro_new', 'cap_tra_new', 'cap_sto_c_new',
+                    'cap_sto_p_new', 'co2_pro_out', 'e_co_stock']
+
+# table and attribute of installed capacity by total capacity variable
+INSTALLED_CAPACITY = {
+    'cap_pro': ('process', 'inst-cap'),
+    'cap_tra': ('transmission', 'inst-cap'),
+    'cap_sto_c': ('storage', 'inst-cap-c'),
+    'cap_sto_p': ('storage', 'inst-cap-p')}
+
+# input attributes that become mutable Params in create_model(mutable=True)
+# and can be changed by update_model
+MUTABLE_ATTRIBUTES = [
+    ('commodity', ['price', 'max', 'maxperstep']),
+    ('process', ['eff', 'cap-lo', 'cap-up']),
+    ('transmission', ['eff', 'cap-lo', 'cap-up']),
+    ('storage', ['eff-in', 'eff-out', 'cap-lo-c', 'cap-up-c',
+                 'cap-lo-p', 'cap-up-p'])]
+
+# input attributes read by the model, checked for NaN values by validate
+MODEL_ATTRIBUTES = [
+    ('process', ['inst-cap', 'cap-lo', 'cap-up', 'eff', 'inv-cost',
+                 'fix-cost', 'var-cost', 'wacc', 'depreciation', 'co2']),
+    ('transmission', ['inst-cap', 'cap-lo', 'cap-up', 'eff', 'inv-cost',
+                      'fix-cost', 'var-cost', 'wacc', 'depreciation']),
+    ('storage', ['inst-cap-c', 'cap-lo-c', 'cap-up-c', 'inst-cap-p',
+                 'cap-lo-p', 'cap-up-p', 'eff-in', 'eff-out', 'inv-cost-p',
+                 'inv-cost-c', 'fix-cost-p', 'fix-cost-c', 'var-cost-p',
+                 'var-cost-c', 'depreciation', 'wacc', 'init'])]
+
+BUILD_PROFILE_COLUMNS = ['type', 'time', 'indices', 'skipped', 'rows',
+                         'nonzeros']
+
+# progress lines of solver logs as (regular expression, fields) by solver
+SOLVER_LOG_PATTERNS = {
+    'glpk': [
+        # simplex: '*   123: obj =   1.234567890e+05 inf =   0.000e+00 (0)'
+        (r'^[ *]\s*(\d+): obj =\s*(\S+)', ['iterations', 'objective']),
+        # MIP: '+   456: mip =   1.23e+05 >=   1.20e+05   2.4% (9; 0)'
+        (r'^\+\s*(\d+): (?:mip =|>>>>>)\s*(\S+)\s+[<>]=\s+(.*?)\s+(\S+)%',
+         ['iterations', 'objective', 'bound', 'gap']),
+        (r'^Time used:\s*(\S+) secs', ['solver_time'])],
+    'cbc': [
+        (r'^(?:Clp\d+I\s+)?\s*(\d+)\s+Obj\s+(\S+)',
+         ['iterations', 'objective']),
+        (r'^Cbc0010I After \d+ nodes, \d+ on tree, (\S+) best solution, '
+         r'best possible (\S+) \((\S+) seconds\)',
+         ['objective', 'bound', 'solver_time'])],
+    'cplex': [
+        (r'^Iteration:\s+(\d+)\s+.*[Oo]bjective\s+=\s+(\S+)',
+         ['iterations', 'objective']),
+        (r'^Solution time =\s*(\S+) sec', ['solver_time'])],
+    'gurobi': [
+        # simplex: '     123    1.2345e+05   0.000e+00   0.000e+00      1s'
+        (r'^\s*(\d+)\s+(\S+)\s+\S+\s+\S+\s+(\d+)s$',
+         ['iterations', 'objective', 'solver_time'])]}
+
+# fields of the solve statistics returned by solve
+SOLVE_STATS_COLUMNS = ['solver', 'status', 'termination', 'iterations',
+                       'objective', 'bound', 'gap', 'solver_time', 'elapsed']
+
+# columns of the summary DataFrame returned by run_scenarios
+SCENARIO_SUMMARY_COLUMNS = [
+    'scenario', 'status', 'error',
+    'read', 'model', 'solve', 'report', 'plot', 'total']
+
+# tables of the SQLite result store written by report_sql: name, key
+# columns (after scenario and run) and value columns; all site and
+# commodity columns are indexed
+SQL_TABLES = [
+    ('costs', ['cost_type'], ['value']),
+    ('process_caps', ['site', 'process', 'commodity_in', 'commodity_out'],
+     ['total', 'new']),
+    ('transmission_caps', ['site_in', 'site_out', 'transmission',
+                           'commodity'], ['total', 'new']),
+    ('storage_caps', ['site', 'storage', 'commodity'],
+     ['c_total', 'c_new', 'p_total', 'p_new']),
+    ('emissions', ['site', 'process', 'commodity_in', 'commodity_out'],
+     ['co2']),
+    ('energy_sums', ['site', 'commodity', 'type', 'name'], ['value'])]
+
+# empty entry of incidence_index for (site, commodity) pairs without tuples
+EMPTY_INCIDENCE = {
+    'pro_in': (),
+    'pro_out': (),
+    'tra_in': (),
+    'tra_out': (),
+    'sto': ()}
+
+
+def read_excel(filename, cache_dir=None, timesteps=None):
     """Read Excel input file and prepare URBS input dict.
 
     Reads an Excel spreadsheet that adheres to the structure shown in
@@ -47,10 +164,24 @@ def read_excel(filename):
     2. The attribute 'annuity-factor' is derived here from the columns 'wacc'
     and 'depreciation' for 'Process', 'Transmission' and 'Storage'.
 
+    If timesteps are given, 'Demand' and 'SupIm' are cut down to these
+    timesteps right after parsing, so that neither the returned dict nor the
+    cache hold the whole year. For timeseries too large for a spreadsheet,
+    see read_timeseries.
+
+    If cache_dir is given, the prepared dict is pickled to that directory
+    and reused by later calls, as long as neither the spreadsheet content,
+    the timesteps nor the urbs source code have changed (see
+    cache_filename).
+
     Args:
         filename: filename to an Excel spreadsheet with the required sheets
             'Commodity', 'Process', 'Transmission', 'Storage', 'Demand' and
             'SupIm'.
+        cache_dir: optional directory for cached input dicts (default: None,
+            no caching)
+        timesteps: optional list of timesteps to read from 'Demand' and
+            'SupIm' (default: None, all)
 
     Returns:
         a dict of 6 DataFrames
@@ -60,6 +191,11 @@ def read_excel(filename):
         >>> data['commodity'].loc[('Global', 'CO2', 'Env'), 'max']
         150000000.0
     """
+    if cache_dir:
+        cache_file = cache_filename(filename, cache_dir, timesteps)
+        if os.path.exists(cache_file):
+            return pd.read_pickle(cache_file)
+
     with pd.ExcelFile(filename) as xls:
         commodity = xls.parse(
             'Commodity',
@@ -79,6 +215,9 @@ def read_excel(filename):
         supim = xls.parse(
             'SupIm',
             index_col=['t'])
+    if timesteps is not None:
+        demand = demand[demand.index.isin(timesteps)]
+        supim = supim[supim.index.isin(timesteps)]
 
     # prepare input data
     # split columns by dots '.', so that 'DE.Elec' becomes the two-level
@@ -107,35 +246,597 @@ def read_excel(filename):
     for key in data:
         if isinstance(data[key].index, pd.core.index.MultiIndex):
             data[key].sortlevel(inplace=True)
+
+    if cache_dir:
+        write_cache(data, filename, cache_dir, timesteps)
     return data
 
 
-def create_model(data, timesteps, dt=1):
+def source_hash():
+    """Return SHA-1 hash of the urbs source code.
+
+    Used instead of __version__ as version of the input preprocessing and
+    the model formulation in cache keys, so that any edit of urbs.py
+    invalidates cached input dicts and solutions, whether or not the version
+    number has been bumped.
+
+    Returns:
+        hexadecimal hash string
+    """
+    global _source_hash
+    if _source_hash is None:
+        source_file = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        with open(source_file, 'rb') as f:
+            _source_hash = hashlib.sha1(f.read()).hexdigest()
+    return _source_hash
+
+
+def cache_filename(filename, cache_dir, timesteps=None):
+    """Return filename of cached input dict for a given spreadsheet.
+
+    The cache filename contains a hash of the absolute spreadsheet path, the
+    SHA-1 hash of the spreadsheet content and a hash of the urbs source code
+    (see source_hash), so that any change of content or code leads to a new
+    filename, and spreadsheets of the same name in different directories
+    don't share one. If timesteps are given, a hash of them is appended, so
+    that each timestep window of the same spreadsheet is cached separately.
+
+    Args:
+        filename: filename of an Excel spreadsheet
+        cache_dir: directory of cached input dicts
+        timesteps: optional list of timesteps read_excel was called with
+
+    Returns:
+        filename of the pickled input dict within cache_dir
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    window = ''
+    if timesteps is not None:
+        window = '_t' + hashlib.sha1(
+            repr([int(t) for t in timesteps]).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, '{}_{}_{}{}.pickle'.format(
+        _cache_prefix(filename), sha.hexdigest(), source_hash()[:8], window))
+
+
+def _cache_prefix(filename):
+    """Return basename and hash of the absolute path of a spreadsheet."""
+    basename = os.path.splitext(os.path.basename(filename))[0]
+    path_hash = hashlib.sha1(
+        os.path.abspath(filename).encode('utf-8')).hexdigest()[:8]
+    return '{}_{}'.format(basename, path_hash)
+
+
+def write_cache(data, filename, cache_dir, timesteps=None):
+    """Pickle input dict to cache directory, remove outdated cache files.
+
+    Args:
+        data: input dict as returned by read_excel
+        filename: filename of the Excel spreadsheet data was read from
+        cache_dir: directory of cached input dicts, created if needed
+        timesteps: optional list of timesteps read_excel was called with
+
+    Returns:
+        Nothing
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    cache_file = cache_filename(filename, cache_dir, timesteps)
+
+    # remove cache files of older versions of the same spreadsheet (same
+    # absolute path), but keep other timestep windows of the current version
+    current = re.sub(r'(_t[0-9a-f]{8})?\.pickle$', '',
+                     os.path.basename(cache_file))
+    outdated = re.compile(
+        re.escape(_cache_prefix(filename)) + r'_[0-9a-f]{40}_.+\.pickle$')
+    for old_file in os.listdir(cache_dir):
+        if (outdated.match(old_file) and
+                not old_file.startswith(current)):
+            os.remove(os.path.join(cache_dir, old_file))
+
+    # write to temporary file first, so that concurrent readers never see
+    # a partially written cache file
+    temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    pd.to_pickle(data, temp_file)
+    try:
+        os.rename(temp_file, cache_file)
+    except OSError:
+        # another process has written the same cache file in the meantime
+        os.remove(temp_file)
+
+
+def read_timeseries(filename, timesteps=None, key=None, chunksize=10000):
+    """Read a demand or supim timeseries from a CSV or HDF5 file in chunks.
+
+    The file has the layout of the 'Demand' and 'SupIm' sheets of read_excel:
+    an index column 't' and one column per 'Site.Commodity'. It is read in
+    chunks of rows, of which only the given timesteps are kept, so that peak
+    memory scales with the timestep window instead of the whole file.
+
+    CSV files are read until all timesteps have been found. HDF5 files
+    (extension '.h5' or '.hdf5') must be written in table format, e.g. by
+    df.to_hdf(filename, 'demand', format='table'); only rows between the
+    first and the last timestep are read from them. If any of the given
+    timesteps is not found in the file, a ValueError is raised.
+
+    Args:
+        filename: CSV or HDF5 filename
+        timesteps: optional list of timesteps to read (default: None, all)
+        key: node of HDF5 file (default: None, the only node)
+        chunksize: number of rows per chunk (default: 10000)
+
+    Returns:
+        a DataFrame like data['demand'] or data['supim'] of read_excel
+
+    Example:
+        >>> timesteps = range(4000, 4121)
+        >>> data = read_excel('data-example.xlsx', timesteps=timesteps)
+        >>> data['demand'] = read_timeseries('demand.csv', timesteps)
+    """
+    if timesteps is not None:
+        timesteps = set(timesteps)
+        missing = set(timesteps)
+
+    if os.path.splitext(filename)[1] in HDF_EXTENSIONS:
+        where = None
+        if timesteps is not None:
+            where = 'index >= {} & index <= {}'.format(
+                min(timesteps), max(timesteps))
+        chunks = pd.read_hdf(filename, key, where=where, chunksize=chunksize)
+    else:
+        chunks = pd.read_csv(filename, index_col='t', chunksize=chunksize)
+
+    frames = []
+    try:
+        for chunk in chunks:
+            if timesteps is not None:
+                chunk = chunk[chunk.index.isin(timesteps)]
+                missing.difference_update(chunk.index)
+            frames.append(chunk)
+            if timesteps is not None and not missing:
+                break
+    finally:
+        chunks.close()
+    if not frames:
+        raise ValueError("No timesteps found in {}".format(filename))
+    if timesteps is not None and missing:
+        missing = sorted(missing)
+        raise ValueError('{}: {} timesteps missing, e.g. {}'.format(
+            filename, len(missing), missing[0]))
+
+    timeseries = pd.concat(frames)
+    timeseries.index.name = 't'
+    timeseries.columns = split_columns(timeseries.columns, '.')
+    return timeseries
+
+
+def validate(data, timesteps):
+    """Check input for errors that make a model fail or infeasible.
+
+    All checks work on whole tables at once and take milliseconds, so that
+    bad input is found before a model is built and solved. Problems found
+    are:
+
+    * timesteps missing from demand or supim
+    * demand or supim columns without a matching commodity, and SupIm
+      commodities used by a process without a supim column
+    * NaN values in the attributes of MODEL_ATTRIBUTES, in price, max and
+      maxperstep of stock commodities and in the modelled timeseries
+    * capacity bounds with cap-lo > cap-up or inst-cap > cap-up
+    * efficiencies of zero or below
+    * demand above the upper bound of supply at its site and timestep,
+      i.e. the sum of cap-up * supim (1 if not intermittent) of all
+      processes, cap-up * eff of all imports and cap-up-p of all storages
+      of the demand commodity
+
+    Args:
+        data: input dict or Scenario
+        timesteps: list of modelled timesteps
+
+    Returns:
+        list of problem descriptions, empty if none were found
+
+    Example:
+        >>> data = read_excel('data-example.xlsx')
+        >>> validate(data, range(4000, 4121))
+        []
+        >>> # efficiencies do not lower the supply bound, as the model only
+        >>> # bounds process output by capacity
+        >>> data['process']['eff'] *= 0.5
+        >>> validate(data, range(4000, 4121))
+        []
+    """
+    if isinstance(data, Scenario):
+        data = data.apply()
+    timesteps = list(timesteps)
+    commodity = data['commodity']
+    problems = []
+
+    # timeseries
+    for table in ('demand', 'supim'):
+        missing = sorted(set(timesteps) - set(data[table].index))
+        if missing:
+            problems.append('{}: {} timesteps missing, e.g. {}'.format(
+                table, len(missing), missing[0]))
+    tm = pd.Index(timesteps[1:])
+    tm = tm[tm.isin(data['demand'].index) & tm.isin(data['supim'].index)]
+    demand = data['demand'].loc[tm]
+    supim = data['supim'].loc[tm]
+
+    # every demand/supim column needs a matching commodity and vice versa
+    com_types = commodity.index.get_level_values(2)
+    for table, com_type in (('demand', 'Demand'), ('supim', 'SupIm')):
+        commodities = set(
+            (sit, com) for sit, com, typ in commodity.index
+            if typ == com_type)
+        for column in data[table].columns:
+            if column not in commodities:
+                problems.append("{}: no {} commodity for column {}".format(
+                    table, com_type, column))
+    com_supim = set(commodity.index.get_level_values(1)[com_types == 'SupIm'])
+    process = data['process']
+    sites = process.index.get_level_values(0)
+    coins = process.index.get_level_values(2)
+    intermittent = np.array([coin in com_supim for coin in coins],
+                            dtype=bool)
+    for column in sorted(set(zip(sites[intermittent], coins[intermittent])) -
+                         set(supim.columns)):
+        problems.append("supim: column {} missing".format(column))
+
+    # NaN values
+    for table, attributes in MODEL_ATTRIBUTES:
+        frame = data[table]
+        missing = [attr for attr in attributes if attr not in frame.columns]
+        if missing:
+            problems.append("{}: columns {} missing".format(table, missing))
+        isnull = frame[[attr for attr in attributes
+                        if attr in frame.columns]].isnull().stack()
+        for entry in isnull.index[isnull.values]:
+            problems.append("{}: {} of {} is NaN".format(
+                table, entry[-1], entry[:-1]))
+    isnull = commodity.loc[com_types == 'Stock',
+                           ['price', 'max', 'maxperstep']].isnull().stack()
+    for entry in isnull.index[isnull.values]:
+        problems.append("commodity: {} of {} is NaN".format(
+            entry[-1], entry[:-1]))
+    for table, frame in (('demand', demand), ('supim', supim)):
+        isnull = frame.isnull().sum()
+        for column in isnull.index[isnull > 0]:
+            problems.append("{}: {} NaN values in column {}".format(
+                table, isnull[column], column))
+
+    # capacity bounds and efficiencies
+    for table, lo, up, inst in (
+            ('process', 'cap-lo', 'cap-up', 'inst-cap'),
+            ('transmission', 'cap-lo', 'cap-up', 'inst-cap'),
+            ('storage', 'cap-lo-c', 'cap-up-c', 'inst-cap-c'),
+            ('storage', 'cap-lo-p', 'cap-up-p', 'inst-cap-p')):
+        frame = data[table]
+        for low in (lo, inst):
+            if low not in frame.columns or up not in frame.columns:
+                continue
+            for key in frame.index[frame[low] > frame[up]]:
+                problems.append("{}: {} > {} for {}".format(
+                    table, low, up, key))
+    for table, eff in (('process', 'eff'), ('transmission', 'eff'),
+                       ('storage', 'eff-in'), ('storage', 'eff-out')):
+        frame = data[table]
+        if eff not in frame.columns:
+            continue
+        for key in frame.index[frame[eff] <= 0]:
+            problems.append("{}: {} <= 0 for {}".format(table, eff, key))
+
+    # upper bound of supply by (site, commodity) at each timestep
+    if not demand.empty:
+        supply = pd.DataFrame(0.0, index=demand.index,
+                              columns=demand.columns)
+        # process output is only bound by capacity (cf.
+        # res_process_output_by_capacity), intermittent input by supim
+        output = process['cap-up']
+        steady = output[~intermittent].groupby(level=[0, 3]).sum()
+        transmission = data['transmission']
+        imports = (transmission['cap-up'] * transmission['eff']).groupby(
+            level=[1, 3]).sum()
+        storage = data['storage']['cap-up-p'].groupby(level=[0, 2]).sum()
+        for bound in (steady, imports, storage):
+            supply += bound.reindex(demand.columns).fillna(0).values
+        if intermittent.any():
+            columns = list(zip(sites[intermittent], coins[intermittent]))
+            weather = supim.reindex(columns=columns).fillna(0)
+            weather = weather * output[intermittent].values
+            weather.columns = pd.MultiIndex.from_tuples(
+                [(sit, cout) for sit, _, _, cout
+                 in process.index[intermittent]])
+            weather = weather.T.groupby(level=[0, 1]).sum().T
+            supply += weather.reindex(columns=demand.columns).fillna(0)
+
+        shortfall = demand - supply
+        exceeded = shortfall > 1e-9 * demand.abs()
+        for column in demand.columns[exceeded.any().values]:
+            t = shortfall[column].idxmax()
+            problems.append(
+                "demand: {} exceeds upper bound of supply in {} timesteps, "
+                "e.g. at {} ({:.4g} > {:.4g})".format(
+                    column, exceeded[column].sum(), t, demand[column][t],
+                    supply[column][t]))
+    return problems
+
+
+class Scenario(object):
+    """Scenario as a list of changes to a shared, unmodified input dict.
+
+    Instead of modifying the DataFrames of an input dict, changes are
+    recorded as overrides (table, index, column, operation, value). They are
+    only applied when a model is created, and only the tables they concern
+    are copied, so that many scenarios can share one base dict in memory.
+
+    Scenario objects can be passed as data to create_model, create_lp and
+    solve_rolling. Like scenario functions, they can also be called with an
+    input dict, so run_scenario and run_scenarios accept them as well.
+
+    Attributes:
+        base: shared input dict, as returned by read_excel
+        name: scenario name, also available as __name__
+        overrides: list of (table, index, column, operation, value) tuples,
+            applied in this order; operation is 'set' or 'scale'
+
+    Example:
+        >>> base = read_excel('data-example.xlsx')
+        >>> north_caps = Scenario(base, 'scenario_north_process_caps')
+        >>> north_caps.scale(
+        ...     'process', ('North', 'turb', 'Hydro', 'Elec'), 'cap-up', 0.5)
+        >>> north_caps.scale(
+        ...     'process', ('North', 'pp', 'Biomass', 'Elec'), 'cap-up', 0.25)
+        >>> model = create_model(north_caps, range(1, 25))
+    """
+
+    def __init__(self, base, name='scenario', overrides=()):
+        self.base = base
+        self.name = name
+        self.overrides = list(overrides)
+
+    @property
+    def __name__(self):
+        return self.name
+
+    def set(self, table, index, column, value):
+        """Set value of table.loc[index, column].
+
+        Args:
+            table: input dict key, e.g. 'process'
+            index: row label (tuple for MultiIndex) or list of labels
+            column: column name, e.g. 'cap-up'
+            value: new value
+
+        Returns:
+            the Scenario itself, to allow chaining
+        """
+        self.overrides.append((table, index, column, 'set', value))
+        return self
+
+    def scale(self, table, index, column, factor):
+        """Multiply value of table.loc[index, column] by factor.
+
+        Args: like set, with factor instead of value
+
+        Returns:
+            the Scenario itself, to allow chaining
+        """
+        self.overrides.append((table, index, column, 'scale', factor))
+        return self
+
+    def derive(self, name, *others):
+        """Return new Scenario with overrides of this and other Scenarios.
+
+        Args:
+            name: name of the new Scenario
+            *others: Scenarios whose overrides are appended
+
+        Returns:
+            a new Scenario with the same base
+        """
+        overrides = list(self.overrides)
+        for other in others:
+            overrides.extend(other.overrides)
+        return Scenario(self.base, name, overrides)
+
+    def apply(self, data=None):
+        """Return input dict with all overrides applied.
+
+        Args:
+            data: input dict (default: base); it is not modified
+
+        Returns:
+            a new input dict, sharing all tables without overrides with data
+        """
+        if data is None:
+            data = self.base
+        data = dict(data)
+        copied = set()
+        for table, index, column, operation, value in self.overrides:
+            if table not in copied:
+                data[table] = data[table].copy()
+                copied.add(table)
+            if operation == 'scale':
+                data[table].loc[index, column] *= value
+            else:
+                data[table].loc[index, column] = value
+        return data
+
+    def __call__(self, data):
+        return self.apply(data)
+
+
+def aggregate_timeseries(data, timesteps, num_periods, period_length=24,
+                         method='kmedoids', dt=1):
+    """Reduce demand and supim timeseries to representative periods.
+
+    The modelled timesteps timesteps[1:] are cut into periods of equal length
+    (surplus timesteps at the end are dropped). Their combined demand and
+    intermittent supply profiles, each normalised by its maximum, are
+    clustered into num_periods groups. Each group is represented by one
+    period, weighted by the number of periods in the group.
+
+    Args:
+        data: input dict as returned by read_excel
+        timesteps: list of timesteps
+        num_periods: number of representative periods
+        period_length: number of timesteps per period (default: 24)
+        method: 'kmedoids' (representative is an original period) or 'kmeans'
+            (representative is the group mean); default: 'kmedoids'
+        dt: timestep duration in hours (default: 1)
+
+    Returns:
+        (data, timesteps, weight) tuple, to be passed on to create_model
+        together with period_length; data contains the new demand and supim
+        tables, timesteps is range(num_periods * period_length + 1) and weight
+        the list of weights of all modelled timesteps
+
+    Example:
+        >>> data = read_excel('data-example.xlsx')
+        >>> data, timesteps, weight = aggregate_timeseries(
+        ...     data, range(8761), num_periods=12, period_length=24)
+        >>> prob = create_model(data, timesteps, weight=weight,
+        ...                     period_length=24)
+    """
+    num_original = (len(timesteps) - 1) // period_length
+    if not 0 < num_periods <= num_original:
+        raise ValueError('num_periods must be between 1 and {}, got {}'
+                         .format(num_original, num_periods))
+    tm = list(timesteps[1:num_original * period_length + 1])
+
+    # profiles: one row per period, one column per (timestep, timeseries)
+    series = pd.concat([data['demand'].loc[tm], data['supim'].loc[tm]],
+                       axis=1, keys=['demand', 'supim'])
+    scale = series.abs().max().replace(0, 1).values
+    values = series.values / scale
+    profiles = values.reshape(num_original, -1)
+
+    labels, centers = _cluster_periods(profiles, num_periods, method)
+
+    # order representative periods chronologically by their first member,
+    # skipping empty clusters (only possible for identical periods)
+    order = sorted(set(labels), key=lambda k: np.flatnonzero(labels == k)[0])
+    values = np.vstack([centers[k].reshape(period_length, -1)
+                        for k in order]) * scale
+    counts = np.array([np.sum(labels == k) for k in order])
+
+    # first row is the initial timestep 0, which is not modelled
+    values = np.vstack([values[:1], values])
+    index = pd.Index(range(len(values)), name=data['demand'].index.name)
+    series = pd.DataFrame(values, index=index, columns=series.columns)
+
+    data = dict(data)
+    data['demand'] = series['demand']
+    data['supim'] = series['supim']
+    weight = np.repeat(counts * float(8760) /
+                       (num_original * period_length * dt), period_length)
+    return data, range(len(values)), list(weight)
+
+
+def _cluster_periods(profiles, num_periods, method):
+    """Cluster period profiles by k-medoids or k-means.
+
+    Initial centers are the overall medoid, followed by the profile farthest
+    from all centers chosen so far, so that the result is deterministic.
+
+    Args:
+        profiles: 2-dim array, one row per period
+        num_periods: number of clusters
+        method: 'kmedoids' or 'kmeans'
+
+    Returns:
+        (labels, centers) tuple: array of cluster numbers per profile and
+        2-dim array of cluster centers, one row per cluster
+    """
+    if method not in ('kmedoids', 'kmeans'):
+        raise ValueError("method must be 'kmedoids' or 'kmeans', got {!r}"
+                         .format(method))
+
+    # squared euclidean distances between all profiles
+    sq = np.sum(profiles ** 2, axis=1)
+    dist = np.maximum(sq[:, None] + sq[None, :] - 2 * profiles.dot(profiles.T),
+                      0)
+
+    medoids = [int(np.argmin(dist.sum(axis=1)))]
+    while len(medoids) < num_periods:
+        medoids.append(int(np.argmax(dist[:, medoids].min(axis=1))))
+    centers = profiles[medoids]
+
+    labels = None
+    for iteration in range(100):
+        csq = np.sum(centers ** 2, axis=1)
+        cdist = sq[:, None] + csq[None, :] - 2 * profiles.dot(centers.T)
+        new_labels = np.argmin(cdist, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+
+        for k in range(num_periods):
+            members = np.flatnonzero(labels == k)
+            if len(members) == 0:
+                continue
+            if method == 'kmeans':
+                centers[k] = profiles[members].mean(axis=0)
+            else:
+                within = dist[np.ix_(members, members)].sum(axis=1)
+                centers[k] = profiles[members[np.argmin(within)]]
+    return labels, centers
+
+
+def create_model(data, timesteps, dt=1, weight=None, period_length=None,
+                 mutable=False, profile=False, compact=False):
     """Create a pyomo ConcreteModel URBS object from given input data.
     
     Args:
         data: a dict of 6 DataFrames with the keys 'commodity', 'process',
-            'transmission', 'storage', 'demand' and 'supim'.
+            'transmission', 'storage', 'demand' and 'supim', or a Scenario
         timesteps: list of timesteps
         dt: timestep duration in hours (default: 1)
+        weight: optional list of weights of the modelled timesteps
+            timesteps[1:] for extrapolation to a year (default: all equal,
+            8760 / (len(timesteps) * dt))
+        period_length: optional number of timesteps per representative
+            period; if given, storage content at each period boundary is
+            equal to the initial content (see aggregate_timeseries)
+        mutable: if True, prices, limits, capacity bounds and efficiencies
+            (see MUTABLE_ATTRIBUTES) become mutable Params, whose values can
+            be changed by update_model without creating a new model
+        profile: if True, record construction time and size of each model
+            component in m.build_profile (see profile_model)
+        compact: if True, the variables listed in DERIVED_ENTITIES and their
+            defining equations are left out and replaced by their definition
+            wherever they are used; get_entity derives their values from the
+            solution
         
     Returns:
         a pyomo ConcreteModel object
     """
-    m = pyomo.ConcreteModel()
+    _import_pyomo()
+    if isinstance(data, Scenario):
+        data = data.apply()
+
+    m = ProfilingModel() if profile else pyomo.ConcreteModel()
     m.name = 'URBS'
     m.settings = {
         'dateformat': '%Y%m%dT%H%M%S',
         'timesteps': timesteps,
+        'dt': dt,
+        'period_length': period_length,
+        'compact': compact,
         }
     m.created = datetime.now().strftime(m.settings['dateformat'])
 
     # Preparations
     # ============
-    # Data import. Syntax to access a value within equation definitions looks
-    # like this:
+    # Data import. The DataFrames are kept for reporting, while equation
+    # definitions read their coefficients from dicts of dicts, which are
+    # much faster to access than a MultiIndex lookup. Syntax to access a
+    # value within equation definitions looks like this:
     #
-    #     m.process.loc[sit, pro, coin, cout][attribute]
+    #     m.process_dict[attribute][sit, pro, coin, cout]
     #
     get_inputs = itemgetter(
         "commodity", "process", "transmission", "storage",
@@ -143,6 +844,21 @@ def create_model(data, timesteps, dt=1):
     (m.commodity, m.process, m.transmission, m.storage,
         m.demand, m.supim) = get_inputs(data)
 
+    m.commodity_dict = m.commodity.to_dict()
+    m.process_dict = m.process.to_dict()
+    m.transmission_dict = m.transmission.to_dict()
+    m.storage_dict = m.storage.to_dict()
+
+    # timeseries are cut down to the modelled timesteps; their dicts are
+    # accessed by column first, then timestep:
+    #
+    #     m.demand_dict[sit, com][tm]
+    #
+    m.demand = m.demand.loc[m.settings['timesteps']]
+    m.supim = m.supim.loc[m.settings['timesteps']]
+    m.demand_dict = m.demand.to_dict()
+    m.supim_dict = m.supim.to_dict()
+
     # Sets
     # ====
     # Syntax: m.{name} = Set({domain}, initialize={values})
@@ -160,6 +876,17 @@ def create_model(data, timesteps, dt=1):
         initialize=m.settings['timesteps'][1:],
         ordered=True,
         doc='Set of modelled timesteps')
+
+    # boundaries between representative periods (without first/last step)
+    if period_length:
+        boundaries = m.settings['timesteps'][period_length:-1:period_length]
+    else:
+        boundaries = []
+    m.t_boundary = pyomo.Set(
+        within=m.t,
+        initialize=boundaries,
+        ordered=True,
+        doc='Set of timesteps between two representative periods')
     
     # site (e.g. north, middle, south...)
     m.sit = pyomo.Set(
@@ -193,7 +920,7 @@ def create_model(data, timesteps, dt=1):
     
     # cost_type
     m.cost_type = pyomo.Set(
-        initialize=['Inv', 'Fix', 'Var', 'Fuel'],
+        initialize=COST_TYPES,
         doc='Set of cost types (hard-coded)')
 
     # sets of existing tuples:
@@ -221,11 +948,30 @@ def create_model(data, timesteps, dt=1):
         within=m.com,
         initialize=set(c[1] for c in m.com_tuples if c[2] == 'Demand'))
 
+    # subsets of tuples, so that equations for only one commodity type are
+    # declared over the tuples they apply to
+    m.demand_tuples = pyomo.Set(
+        within=m.com_tuples,
+        initialize=[c for c in m.com_tuples if c[1] in m.com_demand],
+        doc='Commodity tuples of demand commodities')
+    m.stock_tuples = pyomo.Set(
+        within=m.com_tuples,
+        initialize=[c for c in m.com_tuples if c[1] in m.com_stock],
+        doc='Commodity tuples of stock commodities')
+    m.supim_tuples = pyomo.Set(
+        within=m.pro_tuples,
+        initialize=[p for p in m.pro_tuples if p[2] in m.com_supim],
+        doc='Process tuples with intermittent input commodity')
+
+    # index of process, transmission and storage tuples by (site, commodity)
+    # for fast lookup of the terms in commodity_balance
+    m.incidence = incidence_index(m.pro_tuples, m.tra_tuples, m.sto_tuples)
+
     # Parameters
     # ==========
     # for model entities (commodity, process, transmission, storage) no
-    # parames are needed, just use the DataFrames m.commodity, m.process,
-    # m.storage and m.transmission directly.
+    # parames are needed, just use the dicts m.commodity_dict,
+    # m.process_dict, m.storage_dict and m.transmission_dict directly.
     # Syntax: m.{name} = Param({domain}, initialize={values})
     # where name: param name
     #       domain: one or multiple model sets; empty for scalar parameters
@@ -236,10 +982,40 @@ def create_model(data, timesteps, dt=1):
     # len(list) delivers the number of objects in list as integer    
     # meaning of product len(m.t) * dt ???
     # m.weight >= 1
-    
-    m.weight = pyomo.Param(initialize=float(8760) / (len(m.t) * dt))
+    # unless given (e.g. by aggregate_timeseries), all timesteps have the
+    # same weight
+    if weight is None:
+        weight = [float(8760) / (len(m.t) * dt)] * len(m.tm)
+    elif len(weight) != len(m.tm):
+        raise ValueError('weight must have one value per modelled timestep '
+                         '({}), got {}'.format(len(m.tm), len(weight)))
+
+    m.weight = pyomo.Param(
+        m.tm,
+        initialize=dict(zip(m.settings['timesteps'][1:], weight)),
+        doc='Weight of timestep for extrapolation to a year')
     m.dt = pyomo.Param(initialize=dt)
 
+    # in mutable mode, selected attributes are Params instead of plain
+    # values, e.g. m.process_dict['cap-up'] is m.process_cap_up. Equations
+    # access both the same way, so they need no change.
+    if mutable:
+        tuple_sets = {
+            'commodity': m.com_tuples,
+            'process': m.pro_tuples,
+            'transmission': m.tra_tuples,
+            'storage': m.sto_tuples}
+        for table, attributes in MUTABLE_ATTRIBUTES:
+            entity_dict = getattr(m, table + '_dict')
+            for attribute in attributes:
+                param = pyomo.Param(
+                    tuple_sets[table],
+                    initialize=entity_dict[attribute],
+                    mutable=True,
+                    doc='{} {} (mutable)'.format(table, attribute))
+                setattr(m, _mutable_param_name(table, attribute), param)
+                entity_dict[attribute] = param
+
     # Variables
     # =========
     # listed alphabetically
@@ -250,44 +1026,63 @@ def create_model(data, timesteps, dt=1):
     #       docstring: a documentation string/short description
     
     # capacities
+    # in compact mode, new capacity >= 0 becomes total >= installed capacity
+    def cap_pro_bounds(m, sit, pro, coin, cout):
+        return (m.process_dict['inst-cap'][sit, pro, coin, cout], None)
+
+    def cap_tra_bounds(m, sin, sout, tra, com):
+        return (m.transmission_dict['inst-cap'][sin, sout, tra, com], None)
+
+    def cap_sto_c_bounds(m, sit, sto, com):
+        return (m.storage_dict['inst-cap-c'][sit, sto, com], None)
+
+    def cap_sto_p_bounds(m, sit, sto, com):
+        return (m.storage_dict['inst-cap-p'][sit, sto, com], None)
+
     m.cap_pro = pyomo.Var(
         m.pro_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=cap_pro_bounds if compact else None,
         doc='Total process capacity (MW)')
-    m.cap_pro_new = pyomo.Var(
-        m.pro_tuples,
-        within=pyomo.NonNegativeReals,
-        doc='New process capacity (MW)')
     m.cap_tra = pyomo.Var(
         m.tra_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=cap_tra_bounds if compact else None,
         doc='Total transmission capacity (MW)')
-    m.cap_tra_new = pyomo.Var(
-        m.tra_tuples,
-        within=pyomo.NonNegativeReals,
-        doc='New transmission capacity (MW)')
     m.cap_sto_c = pyomo.Var(
         m.sto_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=cap_sto_c_bounds if compact else None,
         doc='Total storage size (MWh)')
-    m.cap_sto_c_new = pyomo.Var(
-        m.sto_tuples,
-        within=pyomo.NonNegativeReals,
-        doc='New storage size (MWh)')
     m.cap_sto_p = pyomo.Var(
         m.sto_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=cap_sto_p_bounds if compact else None,
         doc='Total storage power (MW)')
-    m.cap_sto_p_new = pyomo.Var(
-        m.sto_tuples,
-        within=pyomo.NonNegativeReals,
-        doc='New  storage power (MW)')
+    if not compact:
+        m.cap_pro_new = pyomo.Var(
+            m.pro_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='New process capacity (MW)')
+        m.cap_tra_new = pyomo.Var(
+            m.tra_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='New transmission capacity (MW)')
+        m.cap_sto_c_new = pyomo.Var(
+            m.sto_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='New storage size (MWh)')
+        m.cap_sto_p_new = pyomo.Var(
+            m.sto_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='New  storage power (MW)')
     
     # emissions
-    m.co2_pro_out = pyomo.Var(
-        m.tm, m.pro_tuples,
-        within=pyomo.NonNegativeReals,
-        doc='CO2 emissions from process (t) per timestep')
+    if not compact:
+        m.co2_pro_out = pyomo.Var(
+            m.tm, m.pro_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='CO2 emissions from process (t) per timestep')
     
     # costs
     m.costs = pyomo.Var(
@@ -296,10 +1091,11 @@ def create_model(data, timesteps, dt=1):
         doc='Costs by type (EUR/a)')
     
     # timeseries
-    m.e_co_stock = pyomo.Var(
-        m.tm, m.com_tuples,
-        within=pyomo.NonNegativeReals,
-        doc='Use of stock commodity source (MW) per timestep')
+    if not compact:
+        m.e_co_stock = pyomo.Var(
+            m.tm, m.com_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='Use of stock commodity source (MW) per timestep')
     m.e_pro_in = pyomo.Var(
         m.tm, m.pro_tuples,
         within=pyomo.NonNegativeReals,
@@ -348,41 +1144,40 @@ def create_model(data, timesteps, dt=1):
     
     # supply >= demand
     def res_demand_rule(m, tm, sit, com, com_type):
-        if com not in m.com_demand:
-            return pyomo.Constraint.Skip
-        else:
-            provided_power = - commodity_balance(m, tm, sit, com)
-            return (provided_power >=
-                    m.demand.loc[tm][sit, com])
+        provided_power = - commodity_balance(m, tm, sit, com)
+        return (provided_power >=
+                m.demand_dict[sit, com][tm])
 
     # calculation of import/purchase???                
     def def_e_co_stock_rule(m, tm, sit, com, com_type):
-        if com not in m.com_stock:
-            return pyomo.Constraint.Skip
-        else:
-            return (m.e_co_stock[tm, sit, com, com_type] ==
-                    commodity_balance(m, tm, sit, com))
+        return (m.e_co_stock[tm, sit, com, com_type] ==
+                commodity_balance(m, tm, sit, com))
     
     # restriction for hourly stock purchase
+    # in compact mode, this also ensures stock use >= 0
     def res_stock_step_rule(m, tm, sit, com, com_type):
-        if com not in m.com_stock:
+        if compact and (sit, com) not in m.incidence:
+            # commodity is not used at all
             return pyomo.Constraint.Skip
+        elif compact:
+            return (0, stock_use(m, tm, sit, com, com_type),
+                    m.commodity_dict['maxperstep'][sit, com, com_type])
         else:
             return (m.e_co_stock[tm, sit, com, com_type] <=
-                    m.commodity.loc[sit, com, com_type]['maxperstep'])
+                    m.commodity_dict['maxperstep'][sit, com, com_type])
 
     # calculate total consumption of commodity com
     def res_stock_total_rule(m, sit, com, com_type):
-        if com not in m.com_stock:
+        if compact and (sit, com) not in m.incidence:
             return pyomo.Constraint.Skip
         else:
             total_consumption = 0
             for tm in m.tm:
                 total_consumption += (
-                    m.e_co_stock[tm, sit, com, com_type] * m.dt)
-            total_consumption *= m.weight
+                    stock_use(m, tm, sit, com, com_type) * m.dt *
+                    m.weight[tm])
             return (total_consumption <=
-                    m.commodity.loc[sit, com, com_type]['max'])
+                    m.commodity_dict['max'][sit, com, com_type])
 
     # process
     
@@ -390,29 +1185,26 @@ def create_model(data, timesteps, dt=1):
     def def_process_capacity_rule(m, sit, pro, coin, cout):
         return (m.cap_pro[sit, pro, coin, cout] ==
                 m.cap_pro_new[sit, pro, coin, cout] +
-                m.process.loc[sit, pro, coin, cout]['inst-cap'])
+                m.process_dict['inst-cap'][sit, pro, coin, cout])
     
     # output == input * efficiency
     def def_process_output_rule(m, tm, sit, pro, coin, cout):
         return (m.e_pro_out[tm, sit, pro, coin, cout] ==
                 m.e_pro_in[tm, sit, pro, coin, cout] *
-                m.process.loc[sit, pro, coin, cout]['eff'])
+                m.process_dict['eff'][sit, pro, coin, cout])
 
     # output == installed capacity * supply per hour by intermittent sources            
     def def_intermittent_supply_rule(m, tm, sit, pro, coin, cout):
-        if coin in m.com_supim:
-            return (m.e_pro_in[tm, sit, pro, coin, cout] ==
-                    m.cap_pro[sit, pro, coin, cout] *
-                    m.supim.loc[tm][sit, coin])
-        else:
-            return pyomo.Constraint.Skip
+        return (m.e_pro_in[tm, sit, pro, coin, cout] ==
+                m.cap_pro[sit, pro, coin, cout] *
+                m.supim_dict[sit, coin][tm])
 
     # calculation of co2 emissions per process
     # per timestep or per year???        
     def def_co2_emissions_rule(m, tm, sit, pro, coin, cout):
         return (m.co2_pro_out[tm, sit, pro, coin, cout] ==
                 m.e_pro_in[tm, sit, pro, coin, cout] *
-                m.process.loc[sit, pro, coin, cout]['co2'] *
+                m.process_dict['co2'][sit, pro, coin, cout] *
                 m.dt)
     
     # output <= capacity 
@@ -422,9 +1214,9 @@ def create_model(data, timesteps, dt=1):
     
     # lower bound <= process capacity <= upper bound
     def res_process_capacity_rule(m, sit, pro, coin, cout):
-        return (m.process.loc[sit, pro, coin, cout]['cap-lo'],
+        return (m.process_dict['cap-lo'][sit, pro, coin, cout],
                 m.cap_pro[sit, pro, coin, cout],
-                m.process.loc[sit, pro, coin, cout]['cap-up'])
+                m.process_dict['cap-up'][sit, pro, coin, cout])
 
     # transmission
     
@@ -432,13 +1224,13 @@ def create_model(data, timesteps, dt=1):
     def def_transmission_capacity_rule(m, sin, sout, tra, com):
         return (m.cap_tra[sin, sout, tra, com] ==
                 m.cap_tra_new[sin, sout, tra, com] +
-                m.transmission.loc[sin, sout, tra, com]['inst-cap'])
+                m.transmission_dict['inst-cap'][sin, sout, tra, com])
 
     # output == input * efficiency
     def def_transmission_output_rule(m, tm, sin, sout, tra, com):
         return (m.e_tra_out[tm, sin, sout, tra, com] ==
                 m.e_tra_in[tm, sin, sout, tra, com] *
-                m.transmission.loc[sin, sout, tra, com]['eff'])
+                m.transmission_dict['eff'][sin, sout, tra, com])
     
     # input <= transmission capacity
     def res_transmission_input_by_capacity_rule(m, tm, sin, sout, tra, com):
@@ -447,9 +1239,9 @@ def create_model(data, timesteps, dt=1):
     
     # lower bound <= transmission capacity <= upper bound
     def res_transmission_capacity_rule(m, sin, sout, tra, com):
-        return (m.transmission.loc[sin, sout, tra, com]['cap-lo'],
+        return (m.transmission_dict['cap-lo'][sin, sout, tra, com],
                 m.cap_tra[sin, sout, tra, com],
-                m.transmission.loc[sin, sout, tra, com]['cap-up'])
+                m.transmission_dict['cap-up'][sin, sout, tra, com])
     
     # input capacity == output capacity
     def res_transmission_symmetry_rule(m, sin, sout, tra, com):
@@ -463,21 +1255,21 @@ def create_model(data, timesteps, dt=1):
         return (m.e_sto_con[t, sit, sto, com] ==
                 m.e_sto_con[t-1, sit, sto, com] +
                 m.e_sto_in[t, sit, sto, com] *
-                m.storage.loc[sit, sto, com]['eff-in'] * m.dt -
+                m.storage_dict['eff-in'][sit, sto, com] * m.dt -
                 m.e_sto_out[t, sit, sto, com] /
-                m.storage.loc[sit, sto, com]['eff-out'] * m.dt)
+                m.storage_dict['eff-out'][sit, sto, com] * m.dt)
 
     # storage power == new power + existing power            
     def def_storage_power_rule(m, sit, sto, com):
         return (m.cap_sto_p[sit, sto, com] ==
                 m.cap_sto_p_new[sit, sto, com] +
-                m.storage.loc[sit, sto, com]['inst-cap-p'])
+                m.storage_dict['inst-cap-p'][sit, sto, com])
     
     # storage capacity == new capacity + existing capacity
     def def_storage_capacity_rule(m, sit, sto, com):
         return (m.cap_sto_c[sit, sto, com] ==
                 m.cap_sto_c_new[sit, sto, com] +
-                m.storage.loc[sit, sto, com]['inst-cap-c'])
+                m.storage_dict['inst-cap-c'][sit, sto, com])
     
     # input <= power
     def res_storage_input_by_power_rule(m, t, sit, sto, com):
@@ -493,15 +1285,15 @@ def create_model(data, timesteps, dt=1):
 
     # lower bound <= power <= upper bound    
     def res_storage_power_rule(m, sit, sto, com):
-        return (m.storage.loc[sit, sto, com]['cap-lo-p'],
+        return (m.storage_dict['cap-lo-p'][sit, sto, com],
                 m.cap_sto_p[sit, sto, com],
-                m.storage.loc[sit, sto, com]['cap-up-p'])
+                m.storage_dict['cap-up-p'][sit, sto, com])
 
     # lower bound <= capacity <= upper bound
     def res_storage_capacity_rule(m, sit, sto, com):
-        return (m.storage.loc[sit, sto, com]['cap-lo-c'],
+        return (m.storage_dict['cap-lo-c'][sit, sto, com],
                 m.cap_sto_c[sit, sto, com],
-                m.storage.loc[sit, sto, com]['cap-up-c'])
+                m.storage_dict['cap-up-c'][sit, sto, com])
 
     # initialization of storage content in first timestep t[1]
     # initialization of storage content in final timestep t[len(m.t)]
@@ -510,20 +1302,26 @@ def create_model(data, timesteps, dt=1):
         if t == m.t[1]:  # first timestep (Pyomo uses 1-based indexing)
             return (m.e_sto_con[t, sit, sto, com] ==
                     m.cap_sto_c[sit, sto, com] *
-                    m.storage.loc[sit, sto, com]['init'])
+                    m.storage_dict['init'][sit, sto, com])
         elif t == m.t[len(m.t)]:  # last timestep
             return (m.e_sto_con[t, sit, sto, com] >=
                     m.cap_sto_c[sit, sto, com] *
-                    m.storage.loc[sit, sto, com]['init'])
+                    m.storage_dict['init'][sit, sto, com])
         else:
             return pyomo.Constraint.Skip
 
+    # content at boundaries of representative periods == initial content
+    def res_storage_period_cycle_rule(m, t, sit, sto, com):
+        return (m.e_sto_con[t, sit, sto, com] ==
+                m.e_sto_con[m.t[1], sit, sto, com])
+
     # emissions
     
     # total co2 emissions <= maximum emissions
     def res_co2_emission_rule(m):
-        return (pyomo.summation(m.co2_pro_out) * m.weight <=
-                m.commodity.loc['Global', 'CO2', 'Env']['max'])
+        return (sum(co2_emissions(m, tm, *p) * m.weight[tm]
+                    for tm in m.tm for p in m.pro_tuples) <=
+                m.commodity_dict['max']['Global', 'CO2', 'Env'])
 
     # costs
     def def_costs_rule(m, cost_type):
@@ -545,55 +1343,54 @@ def create_model(data, timesteps, dt=1):
         """
         if cost_type == 'Inv':
             return m.costs['Inv'] == \
-                sum(m.cap_pro_new[p] *
-                    m.process.loc[p]['inv-cost'] *
-                    m.process.loc[p]['annuity-factor']
+                sum(new_capacity(m, 'cap_pro', p) *
+                    m.process_dict['inv-cost'][p] *
+                    m.process_dict['annuity-factor'][p]
                     for p in m.pro_tuples) + \
-                sum(m.cap_tra_new[t] *
-                    m.transmission.loc[t]['inv-cost'] *
-                    m.transmission.loc[t]['annuity-factor']
+                sum(new_capacity(m, 'cap_tra', t) *
+                    m.transmission_dict['inv-cost'][t] *
+                    m.transmission_dict['annuity-factor'][t]
                     for t in m.tra_tuples) + \
-                sum(m.cap_sto_p_new[s] *
-                    m.storage.loc[s]['inv-cost-p'] *
-                    m.storage.loc[s]['annuity-factor'] +
-                    m.cap_sto_c_new[s] *
-                    m.storage.loc[s]['inv-cost-c'] *
-                    m.storage.loc[s]['annuity-factor']
+                sum(new_capacity(m, 'cap_sto_p', s) *
+                    m.storage_dict['inv-cost-p'][s] *
+                    m.storage_dict['annuity-factor'][s] +
+                    new_capacity(m, 'cap_sto_c', s) *
+                    m.storage_dict['inv-cost-c'][s] *
+                    m.storage_dict['annuity-factor'][s]
                     for s in m.sto_tuples)
 
         elif cost_type == 'Fix':
             return m.costs['Fix'] == \
-                sum(m.cap_pro[p] * m.process.loc[p]['fix-cost']
+                sum(m.cap_pro[p] * m.process_dict['fix-cost'][p]
                     for p in m.pro_tuples) + \
-                sum(m.cap_tra[t] * m.transmission.loc[t]['fix-cost']
+                sum(m.cap_tra[t] * m.transmission_dict['fix-cost'][t]
                     for t in m.tra_tuples) + \
-                sum(m.cap_sto_p[s] * m.storage.loc[s]['fix-cost-p'] +
-                    m.cap_sto_c[s] * m.storage.loc[s]['fix-cost-c']
+                sum(m.cap_sto_p[s] * m.storage_dict['fix-cost-p'][s] +
+                    m.cap_sto_c[s] * m.storage_dict['fix-cost-c'][s]
                     for s in m.sto_tuples)
 
         elif cost_type == 'Var':
             return m.costs['Var'] == \
                 sum(m.e_pro_out[(tm,) + p] * m.dt *
-                    m.process.loc[p]['var-cost'] *
-                    m.weight
+                    m.process_dict['var-cost'][p] *
+                    m.weight[tm]
                     for tm in m.tm for p in m.pro_tuples) + \
                 sum(m.e_tra_in[(tm,) + t] * m.dt *
-                    m.transmission.loc[t]['var-cost'] *
-                    m.weight
+                    m.transmission_dict['var-cost'][t] *
+                    m.weight[tm]
                     for tm in m.tm for t in m.tra_tuples) + \
                 sum(m.e_sto_con[(tm,) + s] *
-                    m.storage.loc[s]['var-cost-c'] * m.weight +
+                    m.storage_dict['var-cost-c'][s] * m.weight[tm] +
                     (m.e_sto_in[(tm,) + s] + m.e_sto_out[(tm,) + s]) * m.dt *
-                    m.storage.loc[s]['var-cost-p'] * m.weight
+                    m.storage_dict['var-cost-p'][s] * m.weight[tm]
                     for tm in m.tm for s in m.sto_tuples)
 
         elif cost_type == 'Fuel':
             return m.costs['Fuel'] == sum(
-                m.e_co_stock[(tm,) + c] * m.dt *
-                m.commodity.loc[c]['price'] *
-                m.weight
-                for tm in m.tm for c in m.com_tuples
-                if c[1] in m.com_stock)
+                stock_use(m, tm, *c) * m.dt *
+                m.commodity_dict['price'][c] *
+                m.weight[tm]
+                for tm in m.tm for c in m.stock_tuples)
 
         else:
             raise NotImplementedError("Unknown cost type.")
@@ -612,31 +1409,34 @@ def create_model(data, timesteps, dt=1):
 
     # commodity
     m.res_demand = pyomo.Constraint(
-        m.tm, m.com_tuples,
+        m.tm, m.demand_tuples,
         doc='storage + transmission + process + source >= demand')
-    m.def_e_co_stock = pyomo.Constraint(
-        m.tm, m.com_tuples,
-        doc='commodity source term = commodity consumption per timestep')
+    if not compact:
+        m.def_e_co_stock = pyomo.Constraint(
+            m.tm, m.stock_tuples,
+            doc='commodity source term = commodity consumption per timestep')
     m.res_stock_step = pyomo.Constraint(
-        m.tm, m.com_tuples,
+        m.tm, m.stock_tuples,
         doc='commodity source term <= commodity.maxperstep')
     m.res_stock_total = pyomo.Constraint(
-        m.com_tuples,
+        m.stock_tuples,
         doc='total commodity source term <= commodity.max')
 
     # process
-    m.def_process_capacity = pyomo.Constraint(
-        m.pro_tuples,
-        doc='total process capacity = inst-cap + new capacity')
+    if not compact:
+        m.def_process_capacity = pyomo.Constraint(
+            m.pro_tuples,
+            doc='total process capacity = inst-cap + new capacity')
     m.def_process_output = pyomo.Constraint(
         m.tm, m.pro_tuples,
         doc='process output = process input * efficiency')
     m.def_intermittent_supply = pyomo.Constraint(
-        m.tm, m.pro_tuples,
+        m.tm, m.supim_tuples,
         doc='process output = process capacity * supim timeseries')
-    m.def_co2_emissions = pyomo.Constraint(
-        m.tm, m.pro_tuples,
-        doc='process co2 output = process input * process.co2 * weight')
+    if not compact:
+        m.def_co2_emissions = pyomo.Constraint(
+            m.tm, m.pro_tuples,
+            doc='process co2 output = process input * process.co2 * weight')
     m.res_process_output_by_capacity = pyomo.Constraint(
         m.tm, m.pro_tuples,
         doc='process output <= total process capacity')
@@ -645,9 +1445,10 @@ def create_model(data, timesteps, dt=1):
         doc='process.cap-lo <= total process capacity <= process.cap-up')
 
     # transmission
-    m.def_transmission_capacity = pyomo.Constraint(
-        m.tra_tuples,
-        doc='total transmission capacity = inst-cap + new capacity')
+    if not compact:
+        m.def_transmission_capacity = pyomo.Constraint(
+            m.tra_tuples,
+            doc='total transmission capacity = inst-cap + new capacity')
     m.def_transmission_output = pyomo.Constraint(
         m.tm, m.tra_tuples,
         doc='transmission output = transmission input * efficiency')
@@ -666,12 +1467,13 @@ def create_model(data, timesteps, dt=1):
     m.def_storage_state = pyomo.Constraint(
         m.tm, m.sto_tuples,
         doc='storage[t] = storage[t-1] + input - output')
-    m.def_storage_power = pyomo.Constraint(
-        m.sto_tuples,
-        doc='storage power = inst-cap + new power')
-    m.def_storage_capacity = pyomo.Constraint(
-        m.sto_tuples,
-        doc='storage capacity = inst-cap + new capacity')
+    if not compact:
+        m.def_storage_power = pyomo.Constraint(
+            m.sto_tuples,
+            doc='storage power = inst-cap + new power')
+        m.def_storage_capacity = pyomo.Constraint(
+            m.sto_tuples,
+            doc='storage capacity = inst-cap + new capacity')
     m.res_storage_input_by_power = pyomo.Constraint(
         m.tm, m.sto_tuples,
         doc='storage input <= storage power')
@@ -690,6 +1492,9 @@ def create_model(data, timesteps, dt=1):
     m.res_initial_and_final_storage_state = pyomo.Constraint(
         m.t, m.sto_tuples,
         doc='storage content initial == and final >= storage.init * capacity')
+    m.res_storage_period_cycle = pyomo.Constraint(
+        m.t_boundary, m.sto_tuples,
+        doc='storage content between representative periods == initial')
 
     # emissions
     m.res_co2_emission = pyomo.Constraint(
@@ -706,160 +1511,1929 @@ def create_model(data, timesteps, dt=1):
     return m
 
 
-def annuity_factor(n, i):
-    """Annuity factor formula.
+def profile_model(data, timesteps, **kwargs):
+    """Create a model instance and profile the construction of its parts.
 
-    Evaluates the annuity factor formula for depreciation duration
-    and interest rate. Works also well for equally sized numpy arrays
-    of values for n and i.
-    
     Args:
-        n: depreciation period (years)
-        i: interest rate (percent, e.g. 0.06 means 6 %)
+        data: input dict, passed to create_model
+        timesteps: list of timesteps, passed to create_model
+        **kwargs: further keyword arguments to create_model
 
     Returns:
-        Value of the expression :math:`\\frac{(1+i)^n i}{(1+i)^n - 1}`
+        (instance, profile) tuple of the created model instance and a
+        DataFrame with one row per model component in order of construction,
+        plus a final row for model.create(). Columns are the component type,
+        wall time in seconds, number of indices, number of skipped indices,
+        resulting constraint rows and their nonzero coefficients.
 
     Example:
-        >>> round(annuity_factor(20, 0.07), 5)
-        0.09439
-
+        >>> prob, profile = profile_model(data, range(4000, 4121))
+        >>> profile.groupby('type')['time'].sum()
+        >>> profile.to_csv('results/profile.csv')
     """
-    return (1+i)**n * i / ((1+i)**n - 1)
-
-
-def commodity_balance(m, tm, sit, com):
-    """Calculate commodity balance at given timestep.
+    model = create_model(data, timesteps, profile=True, **kwargs)
+    start = time.time()
+    instance = model.create()
+    records = model.build_profile + [
+        ('create()', 'Model', time.time() - start, 0, 0, 0, 0)]
 
-    For a given commodity co and timestep tm, calculate the balance of
-    consumed (to process/storage/transmission, counts positive) and provided
-    (from process/storage/transmission, counts negative) power. Used as helper
-    function in create_model for constraints on demand and stock commodities.
+    profile = pd.DataFrame(records, columns=['name'] + BUILD_PROFILE_COLUMNS)
+    profile.set_index('name', inplace=True)
+    return instance, profile
 
-    Args:
-        m: the model object
-        tm: the timestep
-        site: the site
-        com: the commodity
 
-    Returns
-        balance: net value of consumed (positive) or provided (negative) power
+def _import_pyomo():
+    """Import coopr.pyomo and define ProfilingModel on first call.
 
+    Returns:
+        the coopr.pyomo module, also available as module global pyomo
     """
-    balance = 0
-    for p in m.pro_tuples:
-        if p[0] == sit and p[2] == com:
-            # usage as input for process increases balance
-            balance += m.e_pro_in[(tm,)+p]
-        if p[0] == sit and p[3] == com:
-            # output from processes decreases balance
-            balance -= m.e_pro_out[(tm,)+p]
-    for t in m.tra_tuples:
-        # exports increase balance
-        if t[0] == sit and t[3] == com:
-            balance += m.e_tra_in[(tm,)+t]
-        # imports decrease balance
-        if t[1] == sit and t[3] == com:
-            balance -= m.e_tra_out[(tm,)+t]
-    for s in m.sto_tuples:
-        # usage as input for storage increases consumption
-        # output from storage decreases consumption
-        if s[0] == sit and s[2] == com:
-            balance += m.e_sto_in[(tm,)+s]
-            balance -= m.e_sto_out[(tm,)+s]
-    return balance
+    global pyomo, ProfilingModel
+    if pyomo is not None:
+        return pyomo
+    import coopr.pyomo as pyomo
+
+    class ProfilingModel(pyomo.ConcreteModel):
+        """ConcreteModel that records the construction of each component.
+
+        Components of a ConcreteModel are constructed as soon as they are
+        assigned to the model, so the time of the assignment is the
+        construction time. Records are appended to the list attribute
+        build_profile as tuples (name, type, time, indices, skipped, rows,
+        nonzeros).
+        """
 
+        def __init__(self, *args, **kwargs):
+            super(ProfilingModel, self).__init__(*args, **kwargs)
+            self.build_profile = []
+
+        def __setattr__(self, name, value):
+            component_types = [
+                ('Set', pyomo.Set), ('Param', pyomo.Param),
+                ('Var', pyomo.Var), ('Constraint', pyomo.Constraint),
+                ('Objective', pyomo.Objective)]
+            for type_name, component_type in component_types:
+                if isinstance(value, component_type):
+                    break
+            else:
+                return super(ProfilingModel, self).__setattr__(name, value)
+
+            start = time.time()
+            super(ProfilingModel, self).__setattr__(name, value)
+            duration = time.time() - start
+
+            # count indices and resulting rows after timing
+            component = getattr(self, name)
+            if type_name == 'Set':
+                indices = len(component)
+            elif component.dim() > 0:
+                indices = len(component.index_set())
+            else:
+                indices = 1
+            skipped, rows, nonzeros = 0, 0, 0
+            if type_name == 'Constraint':
+                skipped = indices - len(component)
+                rows = len(component)
+                nonzeros = sum(_count_variables(con.body)
+                               for con in component.values())
+            elif type_name == 'Objective':
+                rows = len(component)
+                nonzeros = sum(_count_variables(obj.expr)
+                               for obj in component.values())
+            self.build_profile.append((name, type_name, duration, indices,
+                                       skipped, rows, nonzeros))
+
+    return pyomo
+
+
+def _count_variables(expression):
+    """Return number of distinct variables in a Pyomo expression."""
+    try:
+        # Coopr, used by create_model: linear terms of the canonical
+        # representation
+        from coopr.pyomo.repn import generate_canonical_repn
+    except ImportError:
+        # Pyomo >= 5.6
+        from pyomo.core.expr.visitor import identify_variables
+        return len(set(id(v) for v in identify_variables(expression)))
+    return len(generate_canonical_repn(expression).get(1, {}))
 
-def split_columns(columns, sep='.'):
-    """Split columns by separator into MultiIndex.
 
-    Given a list of column labels containing a separator string (default: '.'),
-    derive a MulitIndex that is split at the separator string.
+def update_model(instance, data):
+    """Change mutable parameters of a model instance to new input data.
+
+    Allows to solve several scenarios with the same instance, as long as they
+    only differ in the attributes listed in MUTABLE_ATTRIBUTES. The instance
+    keeps all its constraints; only their coefficients change.
 
     Args:
-        columns: list of column labels, containing the separator string
-        sep: the separator string (default: '.')
-        
+        instance: a model instance created with create_model(...,
+            mutable=True)
+        data: input dict with changed values
+
     Returns:
-        a MultiIndex corresponding to input, with levels split at separator
+        Nothing
 
     Example:
-        >>> split_columns(['DE.Elec', 'MA.Elec', 'NO.Wind'])
-        MultiIndex(levels=[[u'DE', u'MA', u'NO'], [u'Elec', u'Wind']],
-                   labels=[[0, 1, 2], [0, 0, 1]])
-
+        >>> prob = create_model(data, timesteps, mutable=True).create()
+        >>> prob.load(optim.solve(prob))
+        >>> update_model(prob, scenario_co2_limit(copy.deepcopy(data)))
+        >>> prob.load(optim.solve(prob))
     """
-    column_tuples = [tuple(col.split('.')) for col in columns]
-    return pd.MultiIndex.from_tuples(column_tuples)
-
-
-def get_entity(instance, name):
-    """ Return a DataFrame for an entity in model instance.
+    for table, attributes in MUTABLE_ATTRIBUTES:
+        if not hasattr(instance, _mutable_param_name(table, attributes[0])):
+            raise ValueError('instance was not created with mutable=True')
+
+        old, new = getattr(instance, table), data[table]
+        if not old.index.equals(new.index):
+            raise ValueError('{} tuples differ, create a new model instead'
+                             .format(table))
+        fixed = [c for c in old.columns if c not in attributes]
+        changed = (old[fixed] != new[fixed]) & ~(old[fixed].isnull() &
+                                                 new[fixed].isnull())
+        if changed.values.any():
+            raise ValueError('{} attributes {} are not mutable, create a new '
+                             'model instead'.format(
+                                 table, list(changed.columns[changed.any()])))
+
+        for attribute in attributes:
+            param = getattr(instance, _mutable_param_name(table, attribute))
+            for index, value in new[attribute].items():
+                param[index] = value
+        setattr(instance, table, new)
+
+    # let coopr regenerate the constraint representations
+    if hasattr(instance, 'preprocess'):
+        instance.preprocess()
+
+
+def _mutable_param_name(table, attribute):
+    # e.g. ('process', 'cap-up') -> 'process_cap_up'
+    return '{}_{}'.format(table, attribute.replace('-', '_'))
+
+
+def solve(instance, solver='glpk', options=None, callback=None,
+          logfile=None, tee=True):
+    """Solve a model instance, following and parsing the solver log.
+
+    The solver interface writes the solver output to a log file, which is
+    read line by line by a background thread while the solver runs.
+    Progress lines of GLPK, CBC, CPLEX and Gurobi (see SOLVER_LOG_PATTERNS)
+    are parsed into iteration count, objective value, objective bound, gap
+    (in percent) and solver time. After solving, the results are loaded into
+    instance. sys.stdout is left untouched, so output of other threads is
+    not affected.
 
     Args:
-        instance: a Pyomo ConcreteModel instance
-        name: name of a Set, Param, Var, Constraint or Objective
+        instance: a model instance, as created by create_model
+        solver: solver name for SolverFactory (default: 'glpk')
+        options: optional dict of solver options
+        callback: optional function, called from the background thread with
+            a copy of the current statistics dict whenever a progress line
+            was parsed
+        logfile: optional filename to keep the complete solver log in
+            (default: None, a temporary file that is removed afterwards)
+        tee: if True (default), also print the solver log to stdout
 
     Returns:
-        a single-columned Pandas DataFrame with domain as index
-    """
-
-    # retrieve entity, its type and its onset names
-    entity = instance.__getattribute__(name)
-    labels = _get_onset_names(entity)
+        dict of solve statistics with the keys SOLVE_STATS_COLUMNS; values
+        that were not found in the log are None
 
-    # extract values
-    if isinstance(entity, pyomo.Set):
-        # Pyomo sets don't have values, only elements
-        results = pd.DataFrame([(v, 1) for v in entity.value])
-
-        # for unconstrained sets, the column label is identical to their index
-        # hence, make index equal to entity name and append underscore to name
-        # (=the later column title) to preserve identical index names for both
-        # unconstrained supersets
-        if not labels:
-            labels = [name]
-            name = name+'_'
+    Example:
+        >>> def progress(stats):
+        ...     print('{iterations}: {objective}'.format(**stats))
+        >>> stats = solve(prob, 'glpk', callback=progress, tee=False)
+    """
+    import coopr.environ
+    from coopr.opt.base import SolverFactory
+
+    optim = SolverFactory(solver)
+    for key, value in (options or {}).items():
+        optim.options[key] = value
+
+    temp_dir = None
+    if logfile is None:
+        temp_dir = tempfile.mkdtemp(prefix='urbs-')
+        logfile = os.path.join(temp_dir, 'solver.log')
+    elif os.path.exists(logfile):
+        # don't parse the log of an earlier solve
+        os.remove(logfile)
+
+    log = SolverLog(solver, callback)
+    done = threading.Event()
+    follower = threading.Thread(target=log.follow, args=(logfile, done))
+    follower.daemon = True
+    follower.start()
+    try:
+        result = optim.solve(instance, tee=tee, logfile=logfile)
+    finally:
+        done.set()
+        follower.join()
+        log.close()
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    instance.load(result)
+
+    stats = log.stats
+    stats['status'] = str(result.solver.status)
+    stats['termination'] = str(result.solver.termination_condition)
+    return stats
+
+
+class SolverLog(object):
+    """Parser of solver output, fed with the log file while it is written.
+
+    solve passes a log file to the solver interface and runs follow in a
+    background thread, which reads new output from that file until the
+    solver has finished.
+
+    Attributes:
+        stats: dict of solve statistics, updated by each parsed line
+    """
 
-    elif isinstance(entity, pyomo.Param):
-        if entity.dim() > 1:
-            results = pd.DataFrame([v[0]+(v[1],) for v in entity.iteritems()])
-        else:
-            results = pd.DataFrame(entity.iteritems())
-    else:
-        # create DataFrame
-        if entity.dim() > 1:
-            # concatenate index tuples with value if entity has
-            # multidimensional indices v[0]
-            results = pd.DataFrame(
-                [v[0]+(v[1].value,) for v in entity.iteritems()])
+    def __init__(self, solver, callback=None):
+        self.patterns = [(re.compile(pattern), fields) for pattern, fields
+                         in SOLVER_LOG_PATTERNS.get(solver, [])]
+        self.callback = callback
+        self.buffer = ''
+        self.start = time.time()
+        self.stats = dict((key, None) for key in SOLVE_STATS_COLUMNS)
+        self.stats['solver'] = solver
+
+    def follow(self, filename, done, interval=0.1):
+        """Parse new content of filename until done is set.
+
+        Args:
+            filename: log file, which need not exist yet
+            done: threading.Event, set once the solver has finished
+            interval: seconds to wait between reads (default: 0.1)
+
+        Returns:
+            Nothing
+        """
+        log = None
+        try:
+            while True:
+                # check done before reading, so that output written just
+                # before the solver finished is read once more
+                finished = done.is_set()
+                if log is None and os.path.exists(filename):
+                    log = open(filename)
+                if log is not None:
+                    self.write(log.read())
+                if finished:
+                    break
+                done.wait(interval)
+        finally:
+            if log is not None:
+                log.close()
+
+    def write(self, text):
+        self.buffer += text
+        lines = self.buffer.split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            self.parse(line)
+
+    def close(self):
+        self.parse(self.buffer)
+        self.buffer = ''
+        self.stats['elapsed'] = time.time() - self.start
+
+    def parse(self, line):
+        """Update stats from a single log line, then call callback."""
+        for pattern, fields in self.patterns:
+            match = pattern.match(line)
+            if match:
+                break
         else:
-            # otherwise, create tuple from scalar index v[0]
-            results = pd.DataFrame(
-                [(v[0], v[1].value) for v in entity.iteritems()])
+            return
 
-    # check for duplicate onset names and append one to several "_" to make
-    # them unique, e.g. ['sit', 'sit', 'com'] becomes ['sit', 'sit_', 'com']
-    for k, label in enumerate(labels):
-        if label in labels[:k]:
-            labels[k] = labels[k] + "_"
-
-    # name columns according to labels + entity name
-    results.columns = labels + [name]
-    results.set_index(labels, inplace=True)
+        for field, value in zip(fields, match.groups()):
+            try:
+                self.stats[field] = (
+                    int(value) if field == 'iterations' else float(value))
+            except ValueError:
+                # e.g. 'not found yet' instead of a value
+                pass
+        self.stats['elapsed'] = time.time() - self.start
+        if self.callback is not None:
+            self.callback(dict(self.stats))
 
-    return results
 
+def create_lp(data, timesteps, dt=1, weight=None, period_length=None,
+              initial_storage=None, unserved_cost=None, final_storage=True):
+    """Create the urbs optimisation problem as a sparse linear programme.
 
-def get_entities(instance, names):
-    """ Return one DataFrame with entities in columns and a common index.
+    Assembles the same formulation as create_model, but directly as sparse
+    constraint matrices. All time-dependent constraints are generated for all
+    timesteps at once, so the time needed does not depend on the speed of
+    Pyomo expression building.
 
-    Works only on entities that share a common domain (set or set_tuple), which
-    is used as index of the returned DataFrame.
+    Capacity limits (cap-lo, cap-up) and the stock limit per timestep
+    (maxperstep) are stored as variable bounds instead of constraints.
 
     Args:
-        instance: a Pyomo ConcreteModel instance
-        names: list of entity names (as returned by list_entities)
+        data: a dict of 6 DataFrames with the keys 'commodity', 'process',
+            'transmission', 'storage', 'demand' and 'supim', or a Scenario
+        timesteps: list of timesteps
+        dt: timestep duration in hours (default: 1)
+        weight: optional list of timestep weights, see create_model
+        period_length: optional length of representative periods, see
+            create_model
+        initial_storage: optional array of storage contents at timesteps[0]
+            (in the order of data['storage'].index), replacing the condition
+            that storages start at storage.init * capacity
+        unserved_cost: optional penalty per unit of demand left unserved
+            (variable e_unserved, not part of any cost type); makes the
+            problem feasible for any fixed capacities
+        final_storage: if False, storage content at timesteps[-1] is not
+            bound to be at least storage.init * capacity (default: True)
+
+    Returns:
+        a LinearProblem object
+    """
+    if isinstance(data, Scenario):
+        data = data.apply()
+
+    get_inputs = itemgetter(
+        "commodity", "process", "transmission", "storage",
+        "demand", "supim")
+    (commodity, process, transmission, storage,
+        demand, supim) = get_inputs(data)
+
+    lp = LinearProblem(data, timesteps, dt)
+    tm = timesteps[1:]
+    if weight is None:
+        weight = np.ones(len(tm)) * float(8760) / (len(timesteps) * dt)
+    weight = np.asarray(weight, dtype=float)
+
+    # tuples and commodity subsets, like the sets in create_model
+    com_tuples = list(commodity.index)
+    pro_tuples = list(process.index)
+    tra_tuples = list(transmission.index)
+    sto_tuples = list(storage.index)
+    com_supim = set(c[1] for c in com_tuples if c[2] == 'SupIm')
+    com_stock = set(c[1] for c in com_tuples if c[2] == 'Stock')
+    com_demand = set(c[1] for c in com_tuples if c[2] == 'Demand')
+    stock_tuples = [c for c in com_tuples if c[1] in com_stock]
+
+    # attribute values as arrays, in the same order as the tuples
+    def values(table, attribute):
+        return table[attribute].values.astype(float)
+
+    # Variables
+    # =========
+    # 2-dimensional variables have shape (len(timesteps), len(tuples))
+    com_labels = ['sit', 'com', 'com_type']
+    pro_labels = ['sit', 'pro', 'com', 'com_']
+    tra_labels = ['sit', 'sit_', 'tra', 'com']
+    sto_labels = ['sit', 'sto', 'com']
+
+    # capacities
+    cap_pro = lp.add_variable(
+        'cap_pro', pro_tuples, pro_labels,
+        lb=values(process, 'cap-lo'), ub=values(process, 'cap-up'))
+    cap_pro_new = lp.add_variable('cap_pro_new', pro_tuples, pro_labels)
+    cap_tra = lp.add_variable(
+        'cap_tra', tra_tuples, tra_labels,
+        lb=values(transmission, 'cap-lo'),
+        ub=values(transmission, 'cap-up'))
+    cap_tra_new = lp.add_variable('cap_tra_new', tra_tuples, tra_labels)
+    cap_sto_c = lp.add_variable(
+        'cap_sto_c', sto_tuples, sto_labels,
+        lb=values(storage, 'cap-lo-c'), ub=values(storage, 'cap-up-c'))
+    cap_sto_c_new = lp.add_variable('cap_sto_c_new', sto_tuples, sto_labels)
+    cap_sto_p = lp.add_variable(
+        'cap_sto_p', sto_tuples, sto_labels,
+        lb=values(storage, 'cap-lo-p'), ub=values(storage, 'cap-up-p'))
+    cap_sto_p_new = lp.add_variable('cap_sto_p_new', sto_tuples, sto_labels)
+
+    # emissions
+    co2_pro_out = lp.add_variable(
+        'co2_pro_out', pro_tuples, pro_labels, timesteps=tm)
+
+    # costs
+    costs = lp.add_variable(
+        'costs', COST_TYPES, ['cost_type'], objective=1)
+
+    # timeseries
+    e_co_stock = lp.add_variable(
+        'e_co_stock', stock_tuples, com_labels, timesteps=tm,
+        ub=np.array([commodity['maxperstep'][c] for c in stock_tuples],
+                    dtype=float))
+    e_pro_in = lp.add_variable(
+        'e_pro_in', pro_tuples, pro_labels, timesteps=tm)
+    e_pro_out = lp.add_variable(
+        'e_pro_out', pro_tuples, pro_labels, timesteps=tm)
+    e_tra_in = lp.add_variable(
+        'e_tra_in', tra_tuples, tra_labels, timesteps=tm)
+    e_tra_out = lp.add_variable(
+        'e_tra_out', tra_tuples, tra_labels, timesteps=tm)
+    e_sto_in = lp.add_variable(
+        'e_sto_in', sto_tuples, sto_labels, timesteps=tm)
+    e_sto_out = lp.add_variable(
+        'e_sto_out', sto_tuples, sto_labels, timesteps=tm)
+    e_sto_con = lp.add_variable(
+        'e_sto_con', sto_tuples, sto_labels, timesteps=timesteps)
+
+    # Equations
+    # =========
+    # listed in the same order as in create_model
+
+    # commodity
+    pro_pos = dict((p, k) for k, p in enumerate(pro_tuples))
+    tra_pos = dict((t, k) for k, t in enumerate(tra_tuples))
+    sto_pos = dict((s, k) for k, s in enumerate(sto_tuples))
+    incidence = incidence_index(pro_tuples, tra_tuples, sto_tuples)
+
+    def add_commodity_balance(sense, rows, sit, com, sign):
+        # add sign * commodity_balance(m, tm, sit, com) to rows
+        tuples = incidence.get((sit, com), EMPTY_INCIDENCE)
+        for p in tuples['pro_in']:
+            lp.add_terms(sense, rows, e_pro_in[:, pro_pos[p]], sign)
+        for p in tuples['pro_out']:
+            lp.add_terms(sense, rows, e_pro_out[:, pro_pos[p]], -sign)
+        for t in tuples['tra_in']:
+            lp.add_terms(sense, rows, e_tra_in[:, tra_pos[t]], sign)
+        for t in tuples['tra_out']:
+            lp.add_terms(sense, rows, e_tra_out[:, tra_pos[t]], -sign)
+        for s in tuples['sto']:
+            lp.add_terms(sense, rows, e_sto_in[:, sto_pos[s]], sign)
+            lp.add_terms(sense, rows, e_sto_out[:, sto_pos[s]], -sign)
+
+    # res_demand: -commodity_balance (+ e_unserved) >= demand
+    demand_tuples = [(sit, com) for sit, com, com_type in com_tuples
+                     if com in com_demand]
+    if unserved_cost is not None:
+        e_unserved = lp.add_variable(
+            'e_unserved', demand_tuples, ['sit', 'com'], timesteps=tm,
+            objective=unserved_cost * dt * weight[:, None])
+    for k, (sit, com) in enumerate(demand_tuples):
+        rows = lp.add_constraints(
+            '<=', -demand.loc[tm][sit, com].values)
+        add_commodity_balance('<=', rows, sit, com, 1)
+        if unserved_cost is not None:
+            lp.add_terms('<=', rows, e_unserved[:, k], -1)
+
+    # def_e_co_stock: e_co_stock == commodity_balance
+    for k, (sit, com, com_type) in enumerate(stock_tuples):
+        rows = lp.add_constraints('==', np.zeros(len(tm)))
+        lp.add_terms('==', rows, e_co_stock[:, k], 1)
+        add_commodity_balance('==', rows, sit, com, -1)
+
+    # res_stock_total: sum of weighted e_co_stock <= max
+    stock_max = np.array([commodity['max'][c] for c in stock_tuples],
+                         dtype=float)
+    limited = np.where(np.isfinite(stock_max))[0]
+    rows = lp.add_constraints('<=', stock_max[limited])
+    lp.add_terms('<=', rows, e_co_stock[:, limited], dt * weight[:, None])
+    for k, row in zip(limited, rows):
+        lp.limit_rows[stock_tuples[k]] = int(row)
+
+    # process
+    # def_process_capacity: cap_pro == cap_pro_new + inst-cap
+    lp.add_equality(
+        [(cap_pro, 1), (cap_pro_new, -1)], values(process, 'inst-cap'))
+
+    # def_process_output: e_pro_out == e_pro_in * eff
+    lp.add_equality(
+        [(e_pro_out, 1), (e_pro_in, -values(process, 'eff'))])
+
+    # def_intermittent_supply: e_pro_in == cap_pro * supim
+    supim_pros = [k for k, p in enumerate(pro_tuples) if p[2] in com_supim]
+    supim_values = supim.loc[tm][
+        [(pro_tuples[k][0], pro_tuples[k][2]) for k in supim_pros]].values
+    lp.add_equality(
+        [(e_pro_in[:, supim_pros], 1),
+         (cap_pro[supim_pros], -supim_values)])
+
+    # def_co2_emissions: co2_pro_out == e_pro_in * co2 * dt
+    lp.add_equality(
+        [(co2_pro_out, 1), (e_pro_in, -values(process, 'co2') * dt)])
+
+    # res_process_output_by_capacity: e_pro_out <= cap_pro
+    lp.add_inequality([(e_pro_out, 1), (cap_pro, -1)])
+
+    # transmission
+    # def_transmission_capacity: cap_tra == cap_tra_new + inst-cap
+    lp.add_equality(
+        [(cap_tra, 1), (cap_tra_new, -1)], values(transmission, 'inst-cap'))
+
+    # def_transmission_output: e_tra_out == e_tra_in * eff
+    lp.add_equality(
+        [(e_tra_out, 1), (e_tra_in, -values(transmission, 'eff'))])
+
+    # res_transmission_input_by_capacity: e_tra_in <= cap_tra
+    lp.add_inequality([(e_tra_in, 1), (cap_tra, -1)])
+
+    # res_transmission_symmetry: capacity of (sin, sout) == (sout, sin)
+    reverse = [tra_pos[sout, sin, tra, com]
+               for sin, sout, tra, com in tra_tuples]
+    lp.add_equality([(cap_tra, 1), (cap_tra[reverse], -1)])
+
+    # storage
+    # def_storage_state: con[t] == con[t-1] + in * eff-in - out / eff-out
+    lp.add_equality(
+        [(e_sto_con[1:], 1), (e_sto_con[:-1], -1),
+         (e_sto_in, -values(storage, 'eff-in') * dt),
+         (e_sto_out, dt / values(storage, 'eff-out'))])
+
+    # def_storage_power, def_storage_capacity: total == new + inst-cap
+    lp.add_equality(
+        [(cap_sto_p, 1), (cap_sto_p_new, -1)], values(storage, 'inst-cap-p'))
+    lp.add_equality(
+        [(cap_sto_c, 1), (cap_sto_c_new, -1)], values(storage, 'inst-cap-c'))
+
+    # res_storage_{input,output}_by_power, res_storage_state_by_capacity
+    lp.add_inequality([(e_sto_in, 1), (cap_sto_p, -1)])
+    lp.add_inequality([(e_sto_out, 1), (cap_sto_p, -1)])
+    lp.add_inequality([(e_sto_con, 1), (cap_sto_c, -1)])
+
+    # res_initial_and_final_storage_state
+    if initial_storage is None:
+        lp.add_equality(
+            [(e_sto_con[0], 1), (cap_sto_c, -values(storage, 'init'))])
+    else:
+        lp.fix(e_sto_con[0], initial_storage)
+    if final_storage:
+        lp.add_inequality(
+            [(cap_sto_c, values(storage, 'init')), (e_sto_con[-1], -1)])
+
+    # res_storage_period_cycle: content at period boundaries == initial
+    if period_length:
+        boundaries = np.arange(period_length, len(tm), period_length)
+        lp.add_equality(
+            [(e_sto_con[boundaries], 1), (e_sto_con[0], -1)])
+
+    # emissions
+    # res_co2_emission: sum of weighted co2_pro_out <= max
+    co2_max = commodity.loc[('Global', 'CO2', 'Env'), 'max']
+    if np.isfinite(co2_max):
+        row = lp.add_constraints('<=', co2_max)
+        lp.add_terms('<=', row, co2_pro_out, weight[:, None])
+        lp.limit_rows['Global', 'CO2', 'Env'] = int(row)
+
+    # costs
+    # def_costs: costs[cost_type] == sum of costs of that type
+    w = weight[:, None]
+    cost_terms = {
+        'Inv': [
+            (cap_pro_new, values(process, 'inv-cost') *
+             values(process, 'annuity-factor')),
+            (cap_tra_new, values(transmission, 'inv-cost') *
+             values(transmission, 'annuity-factor')),
+            (cap_sto_p_new, values(storage, 'inv-cost-p') *
+             values(storage, 'annuity-factor')),
+            (cap_sto_c_new, values(storage, 'inv-cost-c') *
+             values(storage, 'annuity-factor'))],
+        'Fix': [
+            (cap_pro, values(process, 'fix-cost')),
+            (cap_tra, values(transmission, 'fix-cost')),
+            (cap_sto_p, values(storage, 'fix-cost-p')),
+            (cap_sto_c, values(storage, 'fix-cost-c'))],
+        'Var': [
+            (e_pro_out, values(process, 'var-cost') * dt * w),
+            (e_tra_in, values(transmission, 'var-cost') * dt * w),
+            (e_sto_con[1:], values(storage, 'var-cost-c') * w),
+            (e_sto_in, values(storage, 'var-cost-p') * dt * w),
+            (e_sto_out, values(storage, 'var-cost-p') * dt * w)],
+        'Fuel': [
+            (e_co_stock, np.array([commodity['price'][c]
+                                   for c in stock_tuples],
+                                  dtype=float) * dt * w)]}
+    for k, cost_type in enumerate(COST_TYPES):
+        row = lp.add_constraints('==', 0)
+        lp.add_terms('==', row, costs[k], 1)
+        for columns, coefficients in cost_terms[cost_type]:
+            lp.add_terms('==', row, columns, -coefficients)
+        lp.cost_rows.append(int(row))
+
+    return lp
+
+
+def solve_lp(data, timesteps, dt=1, weight=None, period_length=None,
+             **options):
+    """Create and solve the urbs problem with the HiGHS solver of scipy.
+
+    Builds the problem with create_lp and solves it in-process with
+    scipy.optimize.linprog(method='highs'), without writing a problem file.
+
+    Args:
+        data: a dict of 6 DataFrames with the keys 'commodity', 'process',
+            'transmission', 'storage', 'demand' and 'supim', or a Scenario
+        timesteps: list of timesteps
+        dt: timestep duration in hours (default: 1)
+        weight: optional list of timestep weights, see create_model
+        period_length: optional length of representative periods, see
+            create_model
+        **options: solver options, passed on to linprog
+
+    Returns:
+        a Solution object, which can be used in place of a solved model
+        instance in get_constants, get_timeseries, report and plot
+    """
+    lp = create_lp(data, timesteps, dt, weight, period_length)
+    return lp.solution(lp.solve(**options))
+
+
+def solve_rolling(data, timesteps, window, overlap=0, capacities=None, dt=1,
+                  **options):
+    """Solve the urbs problem in consecutive windows of timesteps.
+
+    The modelled timesteps are split into windows of length window, each
+    solved with the sparse matrix backend together with the following
+    overlap timesteps as look-ahead. Capacities are fixed in all windows;
+    storage content at the end of the committed part of one window is the
+    initial content of the next. Only the committed part of each window is
+    kept. Final storage content must be at least storage.init * capacity
+    only at the end of the last window, so that earlier windows may leave
+    their storages as empty or full as the look-ahead suggests. Annual
+    limits (stock and CO2 max) apply to each window in proportion to its
+    length.
+
+    Args:
+        data: a dict of 6 DataFrames with the keys 'commodity', 'process',
+            'transmission', 'storage', 'demand' and 'supim', or a Scenario
+        timesteps: list of timesteps
+        window: number of committed timesteps per window
+        overlap: number of look-ahead timesteps per window (default: 0)
+        capacities: solved model instance or Solution of a prior planning
+            solve (e.g. on aggregated timeseries), whose total capacities
+            are used; if None, installed capacities are used (no expansion)
+        dt: timestep duration in hours (default: 1)
+        **options: solver options, passed on to linprog
+
+    Returns:
+        a Solution object over all timesteps, which can be used in place of a
+        solved model instance in get_constants, get_timeseries, report and
+        plot
+
+    Example:
+        >>> agg, steps, weight = aggregate_timeseries(data, range(8761), 12)
+        >>> plan = solve_lp(agg, steps, weight=weight, period_length=24)
+        >>> prob = solve_rolling(data, range(8761), 168, 24, capacities=plan)
+    """
+    if isinstance(data, Scenario):
+        data = data.apply()
+
+    timesteps = list(timesteps)
+    initial_storage = None
+    windows = []
+    for start in range(0, len(timesteps) - 1, window):
+        stop = min(start + window, len(timesteps) - 1)
+        window_steps = timesteps[start:min(stop + overlap + 1,
+                                           len(timesteps))]
+
+        lp = create_lp(data, window_steps, dt,
+                       initial_storage=initial_storage,
+                       final_storage=(stop == len(timesteps) - 1))
+        for name in ['cap_pro', 'cap_tra', 'cap_sto_c', 'cap_sto_p']:
+            tuples, _, _, columns = lp.variables[name]
+            if capacities is None:
+                lp.fix(lp.variables[name + '_new'][3], 0)
+            else:
+                values = get_entity(capacities, name)[name]
+                missing = [tup for tup in tuples if tup not in values.index]
+                if missing:
+                    raise ValueError('capacities lack {} for {}'.format(
+                        name, ', '.join(map(str, missing))))
+                lp.fix(columns, values.reindex(tuples).values)
+        x = lp.solve(**options)
+
+        committed = timesteps[start + 1:stop + 1]
+        windows.append((lp, x, committed, len(window_steps)))
+        e_sto_con = lp.variables['e_sto_con'][3]
+        initial_storage = x[e_sto_con[stop - start]]
+
+    return _merge_windows(data, timesteps, windows)
+
+
+def _merge_windows(data, timesteps, windows):
+    """Join the committed parts of rolling horizon windows to one Solution.
+
+    Args:
+        data: input dict
+        timesteps: list of all timesteps
+        windows: list of (lp, x, committed, length) tuples of LinearProblem,
+            solution vector, list of committed timesteps and number of
+            timesteps of each window
+
+    Returns:
+        a Solution object over all timesteps
+    """
+    parts = [lp.solution(x).entities for lp, x, _, _ in windows]
+
+    entities = {}
+    for name, entity in parts[0].items():
+        if name == 'tm':
+            continue
+        if 't' not in entity.index.names:
+            # capacities are identical in all windows
+            entities[name] = entity
+            continue
+        frames = [part[name][part[name].index.get_level_values('t').isin(
+                      committed)]
+                  for part, (_, _, committed, _) in zip(parts, windows)]
+        if name == 'e_sto_con':
+            first = parts[0][name]
+            frames.insert(0, first[first.index.get_level_values('t') ==
+                                   timesteps[0]])
+        entities[name] = pd.concat(frames)
+
+    # variable and fuel costs of the committed timesteps only, scaled from
+    # the window length to the total number of timesteps
+    costs = entities['costs']['costs'].copy()
+    for cost_type in ['Var', 'Fuel']:
+        costs[cost_type] = 0
+    for lp, x, committed, length in windows:
+        committed_columns = np.zeros(len(x), dtype=bool)
+        for _, _, steps, columns in lp.variables.values():
+            if steps is not None:
+                rows = np.isin(steps, committed)
+                committed_columns[columns[rows].ravel()] = True
+        A_eq = lp.matrices()[0]
+        for cost_type in ['Var', 'Fuel']:
+            row = A_eq[lp.cost_rows[COST_TYPES.index(cost_type)]]
+            costs[cost_type] -= (row.dot(x * committed_columns)[0] *
+                                 length / len(timesteps))
+    entities['costs'] = costs.to_frame()
+
+    return Solution(data, timesteps, entities)
+
+
+def solve_benders(data, timesteps, block, dt=1, workers=None,
+                  tolerance=1e-4, max_iterations=200, unserved_cost=1e6,
+                  stabilization=0.8, **options):
+    """Solve the urbs problem by Benders decomposition over time blocks.
+
+    A master problem chooses the total capacities (cap_pro, cap_tra,
+    cap_sto_c, cap_sto_p) minimising Inv and Fix costs plus one estimate of
+    the operational (Var and Fuel) costs per time block. It also divides
+    annual limits (stock and CO2 max) among the blocks. For given
+    capacities and limits, each block of timesteps is solved as a dispatch
+    problem with the sparse matrix backend, in parallel worker processes.
+    Its costs and their sensitivity to capacities and limits (marginals)
+    form an optimality cut for the master problem. Iterations stop when the
+    gap between the best solution found and the master bound is below
+    tolerance.
+
+    Note that this solves an approximation of the full problem: storage
+    content is not coupled between blocks. Like period_length in
+    create_model, storages start each block at storage.init * capacity and
+    must end it with at least that content, so the result equals that of
+    solve_lp(..., period_length=block), not of the full year, whenever
+    storages would shift energy across block boundaries (e.g. seasonal
+    storage). Choose block long enough for the storage cycles of interest.
+    Demand may be left unserved at unserved_cost during the iterations, so
+    that every block is feasible for any capacities and limits.
+
+    Args:
+        data: a dict of 6 DataFrames with the keys 'commodity', 'process',
+            'transmission', 'storage', 'demand' and 'supim', or a Scenario
+        timesteps: list of timesteps
+        block: number of timesteps per block
+        dt: timestep duration in hours (default: 1)
+        workers: number of worker processes (default: number of CPUs);
+            1 solves all blocks in the current process
+        tolerance: relative gap between upper and lower bound at which to
+            stop (default: 1e-4)
+        max_iterations: maximum number of master problem solves
+        unserved_cost: penalty per unit of unserved demand (default: 1e6);
+            must exceed the cost of serving it
+        stabilization: weight of the best capacities and limits found so
+            far in those passed to the blocks (default: 0.8); 0 uses the
+            master solution only
+        **options: solver options, passed on to linprog
+
+    Returns:
+        a Solution object over all timesteps, which can be used in place of a
+        solved model instance in get_constants, get_timeseries, report and
+        plot
+
+    Example:
+        >>> prob = solve_benders(data, range(8761), 168, workers=8)
+    """
+    if isinstance(data, Scenario):
+        data = data.apply()
+
+    timesteps = list(timesteps)
+    weight = float(8760) / (len(timesteps) * dt)
+    blocks = _split_blocks(data, timesteps, block)
+
+    # master problem: capacities, their Inv and Fix costs, and operational
+    # costs theta per block
+    capacity_labels = {
+        'cap_pro': ['sit', 'pro', 'com', 'com_'],
+        'cap_tra': ['sit', 'sit_', 'tra', 'com'],
+        'cap_sto_c': ['sit', 'sto', 'com'],
+        'cap_sto_p': ['sit', 'sto', 'com']}
+    master = LinearProblem(data, timesteps, dt)
+    capacity_columns = []
+    constant = 0
+    for name in sorted(INSTALLED_CAPACITY):
+        table, attribute = INSTALLED_CAPACITY[name]
+        suffix = attribute[len('inst-cap'):]
+        df = data[table]
+        inst_cap = df[attribute].values.astype(float)
+        inv_cost = (df['inv-cost' + suffix] *
+                    df['annuity-factor']).values.astype(float)
+        master.add_variable(
+            name, list(df.index), capacity_labels[name],
+            lb=np.maximum(df['cap-lo' + suffix].values, inst_cap),
+            ub=df['cap-up' + suffix].values,
+            objective=inv_cost + df['fix-cost' + suffix].values)
+        capacity_columns.append(master.variables[name][3])
+        constant -= inv_cost.dot(inst_cap)
+    capacity_columns = np.concatenate(capacity_columns)
+
+    # res_transmission_symmetry
+    tra_tuples = list(data['transmission'].index)
+    tra_pos = dict((t, k) for k, t in enumerate(tra_tuples))
+    reverse = [tra_pos[sout, sin, tra, com]
+               for sin, sout, tra, com in tra_tuples]
+    cap_tra = master.variables['cap_tra'][3]
+    master.add_equality([(cap_tra, 1), (cap_tra[reverse], -1)])
+
+    # share of each annual limit per block
+    commodity = data['commodity']
+    limited = _limited_commodities(commodity)
+    limit_columns = master.add_variable(
+        'limit', limited, ['sit', 'com', 'com_type'],
+        timesteps=list(range(len(blocks))))
+    for k, com in enumerate(limited):
+        row = master.add_constraints('<=', commodity['max'][com])
+        master.add_terms('<=', row, limit_columns[:, k], 1)
+
+    theta = master.add_variable(
+        'theta', list(range(len(blocks))), ['block'], objective=1)
+
+    if workers != 1:
+        pool = multiprocessing.Pool(workers)
+    best, best_parts, best_x = np.inf, None, None
+    smoothing = stabilization
+    try:
+        for iteration in range(max_iterations):
+            x = master.solve(**options)
+            lower = master.result.fun + constant
+
+            # query point between master solution and best solution so far
+            # (in-out stabilization); cuts are valid at any point
+            if best_x is not None:
+                x = smoothing * best_x + (1 - smoothing) * x
+
+            # remove round-off, which would make fixed capacities violate
+            # their bounds or transmission symmetry in the blocks
+            x = np.clip(x, master.lb, master.ub)
+            x[cap_tra] = (x[cap_tra] + x[cap_tra[reverse]]) / 2
+            capacities = dict(
+                (name, x[master.variables[name][3]])
+                for name in sorted(INSTALLED_CAPACITY))
+            jobs = [(block_data, steps, dict(zip(limited, x[columns])))
+                    for (block_data, steps), columns
+                    in zip(blocks, limit_columns)]
+
+            run = partial(_solve_benders_block, capacities=capacities,
+                          dt=dt, weight=weight, unserved_cost=unserved_cost,
+                          options=options)
+            if workers == 1:
+                results = [run(job) for job in jobs]
+            else:
+                results = pool.map(run, jobs, chunksize=1)
+
+            # upper bound: capacity costs plus all operational costs
+            upper = (x[capacity_columns].dot(master.c[capacity_columns]) +
+                     constant + sum(result[0] for result in results))
+            if upper < best:
+                best, best_x = upper, x
+                best_parts = [result[-1] for result in results]
+                smoothing = stabilization
+            else:
+                # no improvement: query master solution itself next time
+                smoothing = 0
+            if best - lower <= tolerance * max(abs(best), 1):
+                break
+
+            # optimality cuts: theta >= q + marginals * (point - point_k),
+            # without negligible coefficients and scaled to a largest
+            # coefficient of 1 for numerical stability of the master
+            for k, (q, marginals, _) in enumerate(results):
+                columns = np.concatenate(
+                    [capacity_columns, limit_columns[k]])
+                scale = max(np.abs(marginals).max(), 1)
+                nonzero = np.abs(marginals) > 1e-9 * scale
+                row = master.add_constraints(
+                    '<=', (marginals.dot(x[columns]) - q) / scale)
+                master.add_terms('<=', row, columns[nonzero],
+                                 marginals[nonzero] / scale)
+                master.add_terms('<=', row, theta[k], -1 / scale)
+        else:
+            if np.isfinite(best) and best != 0:
+                gap = '{:.2%}'.format((best - lower) / abs(best))
+            else:
+                gap = 'best {:.4g}, bound {:.4g}'.format(best, lower)
+            raise RuntimeError(
+                "Benders decomposition did not converge in {} iterations "
+                "(gap {})".format(max_iterations, gap))
+    finally:
+        if workers != 1:
+            pool.close()
+            pool.join()
+
+    unserved = sum(part['e_unserved']['e_unserved'].sum()
+                   for part in best_parts)
+    if unserved > 1e-6 * data['demand'].loc[timesteps[1:]].values.sum():
+        raise RuntimeError(
+            "Demand of {:.4g} unserved; problem is infeasible or "
+            "unserved_cost too low".format(unserved))
+    return _merge_blocks(data, timesteps, best_parts,
+                         [steps for _, steps in blocks])
+
+
+def solve_two_stage(data, timesteps, window, num_periods=12,
+                    period_length=24, method='kmedoids', dt=1, workers=None,
+                    unserved_cost=None, **options):
+    """Plan capacities on representative periods, then dispatch in windows.
+
+    First, capacity expansion is solved on the timeseries reduced to
+    num_periods representative periods by aggregate_timeseries. Then the
+    capacities cap_pro, cap_tra, cap_sto_c and cap_sto_p are fixed and the
+    full timesteps are split into dispatch-only windows, which are solved in
+    parallel worker processes and merged into one Solution.
+
+    As windows are solved independently, storages start each window at
+    storage.init * capacity and must end it with at least that content.
+    Annual limits (stock and CO2 max) apply to each window in proportion to
+    its length.
+
+    Args:
+        data: a dict of 6 DataFrames with the keys 'commodity', 'process',
+            'transmission', 'storage', 'demand' and 'supim', or a Scenario
+        timesteps: list of timesteps
+        window: number of timesteps per dispatch window
+        num_periods: number of representative periods for planning
+            (default: 12)
+        period_length: number of timesteps per period (default: 24)
+        method: clustering method, see aggregate_timeseries
+        dt: timestep duration in hours (default: 1)
+        workers: number of worker processes (default: number of CPUs);
+            1 solves all windows in the current process
+        unserved_cost: if given, demand may be left unserved in dispatch at
+            this cost per MWh, so that windows whose peaks are missing from
+            the representative periods stay feasible; the unserved amount
+            is then given by get_entity(prob, 'e_unserved') (default: None)
+        **options: solver options, passed on to linprog
+
+    Returns:
+        a Solution object over all timesteps, which can be used in place of a
+        solved model instance in get_constants, get_timeseries, report and
+        plot
+
+    Example:
+        >>> prob = solve_two_stage(data, range(8761), 168, num_periods=12)
+        >>> report(prob, 'results/two-stage.xlsx', ['Elec'], ['Mid'])
+    """
+    if isinstance(data, Scenario):
+        data = data.apply()
+
+    # stage 1: capacity expansion on representative periods
+    timesteps = list(timesteps)
+    reduced, reduced_steps, reduced_weight = aggregate_timeseries(
+        data, timesteps, num_periods, period_length, method, dt)
+    plan = solve_lp(reduced, reduced_steps, dt, reduced_weight,
+                    period_length, **options)
+    capacities = {}
+    for name in sorted(INSTALLED_CAPACITY):
+        table, _ = INSTALLED_CAPACITY[name]
+        capacities[name] = get_entity(plan, name)[name].reindex(
+            data[table].index).values
+
+    # stage 2: dispatch windows with fixed capacities
+    weight = float(8760) / (len(timesteps) * dt)
+    commodity = data['commodity']
+    jobs = []
+    for window_data, steps in _split_blocks(data, timesteps, window):
+        share = float(len(steps) - 1) / (len(timesteps) - 1)
+        limits = dict((com, commodity['max'][com] * share)
+                      for com in _limited_commodities(commodity))
+        jobs.append((window_data, steps, limits))
+
+    run = partial(_solve_dispatch_window, capacities=capacities, dt=dt,
+                  weight=weight, unserved_cost=unserved_cost,
+                  options=options)
+    if workers == 1:
+        parts = [run(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            parts = pool.map(run, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return _merge_blocks(data, timesteps, parts,
+                         [steps for _, steps, _ in jobs])
+
+
+def _solve_dispatch_window(job, capacities, dt, weight, unserved_cost,
+                           options):
+    """Solve dispatch of one window; helper for solve_two_stage.
+
+    Args:
+        job: (data, timesteps, limits) tuple, see _solve_benders_block
+        capacities, dt, weight, unserved_cost, options: see
+            _solve_benders_block
+
+    Returns:
+        dict of DataFrames of the window solution
+    """
+    data, steps, limits = job
+    lp = _create_block_lp(data, steps, limits, capacities, dt, weight,
+                          unserved_cost)
+    return lp.solution(lp.solve(**options)).entities
+
+
+def _solve_benders_block(job, capacities, dt, weight, unserved_cost,
+                         options):
+    """Solve dispatch of one time block; helper for solve_benders.
+
+    Args:
+        job: (data, timesteps, limits) tuple of input dict, block timesteps
+            and dict of commodity tuple to the block's share of its limit
+        capacities: dict of capacity variable name to array of values
+        dt, weight, unserved_cost, options: see solve_benders
+
+    Returns:
+        (costs, marginals, entities) tuple of operational costs, their
+        sensitivity to capacities (in the order of sorted capacity names)
+        and limits, and the DataFrames of the block solution
+    """
+    data, steps, limits = job
+    lp = _create_block_lp(data, steps, limits, capacities, dt, weight,
+                          unserved_cost)
+    columns = [lp.variables[name][3] for name in sorted(capacities)]
+
+    # operational costs only, Inv and Fix costs are part of the master
+    costs = lp.variables['costs'][3]
+    lp.set_objective(costs[[COST_TYPES.index('Inv'),
+                            COST_TYPES.index('Fix')]], 0)
+
+    x = lp.solve(**options)
+    result = lp.result
+    marginals = result.lower.marginals + result.upper.marginals
+    marginals = np.concatenate(
+        [marginals[np.concatenate(columns)],
+         result.ineqlin.marginals[[lp.limit_rows[com] for com in limits]]])
+    return result.fun, marginals, lp.solution(x).entities
+
+
+def _split_blocks(data, timesteps, block):
+    """Split timesteps into consecutive blocks with their own input.
+
+    Args:
+        data: input dict
+        timesteps: list of timesteps
+        block: number of timesteps per block
+
+    Returns:
+        list of (data, steps) tuples of input dict with demand and supim cut
+        down to the block and block timesteps; the first timestep of each
+        block is the last of the previous one
+    """
+    blocks = []
+    for start in range(0, len(timesteps) - 1, block):
+        steps = timesteps[start:min(start + block, len(timesteps) - 1) + 1]
+        block_data = dict(data)
+        block_data['demand'] = data['demand'].loc[steps]
+        block_data['supim'] = data['supim'].loc[steps]
+        blocks.append((block_data, steps))
+    return blocks
+
+
+def _limited_commodities(commodity):
+    """Return commodity tuples with an annual limit, like in create_lp."""
+    com_stock = set(c[1] for c in commodity.index if c[2] == 'Stock')
+    return [c for c in commodity.index
+            if (c[1] in com_stock or c == ('Global', 'CO2', 'Env')) and
+            np.isfinite(commodity['max'][c])]
+
+
+def _create_block_lp(data, steps, limits, capacities, dt, weight,
+                     unserved_cost=None):
+    """Create dispatch problem of one time block with fixed capacities.
+
+    Args:
+        data: input dict, cut down to the block
+        steps: block timesteps
+        limits: dict of commodity tuple to the block's share of its annual
+            limit (stock or CO2 max)
+        capacities: dict of capacity variable name to array of values
+        dt: timestep duration in hours
+        weight: weight of each timestep, for all blocks alike
+        unserved_cost: optional penalty for unserved demand, see create_lp
+
+    Returns:
+        a LinearProblem object
+    """
+    data = dict(data)
+    data['commodity'] = data['commodity'].copy()
+    for com, limit in limits.items():
+        data['commodity'].loc[com, 'max'] = limit
+
+    lp = create_lp(data, steps, dt, weight=weight * np.ones(len(steps) - 1),
+                   unserved_cost=unserved_cost)
+    for name in sorted(capacities):
+        lp.fix(lp.variables[name][3], capacities[name])
+    return lp
+
+
+def _merge_blocks(data, timesteps, parts, blocks):
+    """Join solutions of consecutive time blocks with equal capacities.
+
+    Args:
+        data: input dict
+        timesteps: list of all timesteps
+        parts: list of entity dicts (see Solution) of the blocks, solved
+            with weights of the whole timesteps
+        blocks: list of timesteps of each block; the first timestep of each
+            block is the last of the previous one
+
+    Returns:
+        a Solution object over all timesteps
+    """
+    entities = {}
+    for name, entity in parts[0].items():
+        if name == 'tm':
+            continue
+        if 't' not in entity.index.names:
+            # capacities (and their costs) are identical in all blocks
+            entities[name] = entity
+            continue
+        frames = [parts[0][name]]
+        for part, steps in zip(parts[1:], blocks[1:]):
+            frame = part[name]
+            frames.append(
+                frame[frame.index.get_level_values('t') != steps[0]])
+        entities[name] = pd.concat(frames)
+
+    # operational costs are the sum over all blocks
+    costs = entities['costs']['costs'].copy()
+    for cost_type in ['Var', 'Fuel']:
+        costs[cost_type] = sum(part['costs']['costs'][cost_type]
+                               for part in parts)
+    entities['costs'] = costs.to_frame()
+
+    return Solution(data, timesteps, entities)
+
+
+class LinearProblem(object):
+    """Sparse matrix representation of a linear optimisation problem.
+
+    Variables are blocks of columns, indexed by tuples and optionally by
+    timestep. Constraints are added as blocks of rows, given by terms of
+    (columns, coefficients) pairs that are broadcast against each other like
+    numpy arrays. The problem is
+
+        minimize c * x
+        s.t.     A_eq * x == b_eq
+                 A_ub * x <= b_ub
+                 lb <= x <= ub
+
+    Attributes:
+        data, timesteps, dt: input of create_lp
+        variables: dict of variable name to (tuples, labels, timesteps,
+            columns) with columns being an array of column numbers
+        cost_rows: equality row numbers of the cost definitions, in the
+            order of COST_TYPES (set by create_lp)
+        limit_rows: dict of commodity tuple to inequality row number of its
+            annual limit (stock and CO2 max, set by create_lp)
+        result: OptimizeResult of the last call to solve, whose
+            lower.marginals and upper.marginals hold the sensitivity of the
+            objective to the variable bounds
+    """
+
+    def __init__(self, data, timesteps, dt=1):
+        self.data = data
+        self.timesteps = timesteps
+        self.dt = dt
+        self.variables = {}
+        self.cost_rows = []
+        self.limit_rows = {}
+        self.result = None
+        self.num_cols = 0
+        self._fixed = ([], [])
+        self._objective = ([], [])
+        self._c, self._lb, self._ub = [], [], []
+        self._rows = {'==': 0, '<=': 0}
+        self._rhs = {'==': [], '<=': []}
+        self._coo = {'==': ([], [], []), '<=': ([], [], [])}
+
+    @property
+    def c(self):
+        c = np.concatenate(self._c)
+        for columns, coefficients in zip(*self._objective):
+            c[columns] = coefficients
+        return c
+
+    @property
+    def lb(self):
+        return self._fix(np.concatenate(self._lb))
+
+    @property
+    def ub(self):
+        return self._fix(np.concatenate(self._ub))
+
+    def _fix(self, bounds):
+        for columns, values in zip(*self._fixed):
+            bounds[columns] = values
+        return bounds
+
+    def fix(self, columns, values):
+        """Fix variables to given values by setting both bounds.
+
+        Args:
+            columns: array of column numbers
+            values: values, broadcast to the shape of columns
+        """
+        columns, values = np.broadcast_arrays(
+            columns, np.asarray(values, dtype=float))
+        self._fixed[0].append(columns.ravel())
+        self._fixed[1].append(values.ravel())
+
+    def set_objective(self, columns, coefficients):
+        """Replace objective coefficients of variables.
+
+        Args:
+            columns: array of column numbers
+            coefficients: new coefficients, broadcast to the shape of columns
+        """
+        columns, coefficients = np.broadcast_arrays(
+            columns, np.asarray(coefficients, dtype=float))
+        self._objective[0].append(columns.ravel())
+        self._objective[1].append(coefficients.ravel())
+
+    def add_variable(self, name, tuples, labels, timesteps=None,
+                     lb=0, ub=np.inf, objective=0):
+        """Add variable block, return array of its column numbers.
+
+        Args:
+            name: variable name, like the corresponding Var in create_model
+            tuples: list of index tuples
+            labels: index names of the tuple levels
+            timesteps: optional list of timesteps as first index dimension
+            lb, ub: lower and upper bounds, broadcast to variable shape
+            objective: objective coefficients, broadcast to variable shape
+
+        Returns:
+            array of column numbers; shape (len(tuples),) or, if timesteps is
+            given, (len(timesteps), len(tuples))
+        """
+        if timesteps is None:
+            shape = (len(tuples),)
+        else:
+            shape = (len(timesteps), len(tuples))
+        size = int(np.prod(shape))
+        columns = np.arange(self.num_cols, self.num_cols + size)
+        columns = columns.reshape(shape)
+        self.num_cols += size
+
+        for values, target in [(objective, self._c), (lb, self._lb),
+                               (ub, self._ub)]:
+            values = np.asarray(values, dtype=float)
+            target.append((np.zeros(shape) + values).ravel())
+        self.variables[name] = (tuples, labels, timesteps, columns)
+        return columns
+
+    def add_constraints(self, sense, rhs):
+        """Add block of empty rows, return array of their row numbers.
+
+        Args:
+            sense: '==' or '<='
+            rhs: array of right-hand side values; determines block shape
+
+        Returns:
+            array of row numbers with the same shape as rhs
+        """
+        rhs = np.asarray(rhs, dtype=float)
+        rows = np.arange(self._rows[sense], self._rows[sense] + rhs.size)
+        self._rows[sense] += rhs.size
+        self._rhs[sense].append(rhs.ravel())
+        return rows.reshape(rhs.shape)
+
+    def add_terms(self, sense, rows, columns, coefficients):
+        """Add coefficients to the constraint matrix.
+
+        Arguments rows, columns and coefficients are broadcast against each
+        other; entries for the same row and column are summed up.
+        """
+        rows, columns, coefficients = np.broadcast_arrays(
+            rows, columns, np.asarray(coefficients, dtype=float))
+        for target, values in zip(self._coo[sense],
+                                  (rows, columns, coefficients)):
+            target.append(values.ravel())
+
+    def add_equality(self, terms, rhs=0):
+        """Add block of constraints sum(coefficients * x[columns]) == rhs.
+
+        Args:
+            terms: list of (columns, coefficients) tuples
+            rhs: right-hand side (default: 0)
+
+        Returns:
+            array of row numbers
+        """
+        return self._add_block('==', terms, rhs)
+
+    def add_inequality(self, terms, rhs=0):
+        """Add block of constraints sum(coefficients * x[columns]) <= rhs.
+
+        Args:
+            terms: list of (columns, coefficients) tuples
+            rhs: right-hand side (default: 0)
+
+        Returns:
+            array of row numbers
+        """
+        return self._add_block('<=', terms, rhs)
+
+    def _add_block(self, sense, terms, rhs):
+        # the block shape is the broadcast shape of all terms and rhs
+        shape = np.broadcast(np.empty(np.shape(rhs)), *[
+            np.empty(np.broadcast(columns, coefficients).shape)
+            for columns, coefficients in terms]).shape
+        rows = self.add_constraints(sense, np.zeros(shape) + rhs)
+        for columns, coefficients in terms:
+            self.add_terms(sense, rows, columns, coefficients)
+        return rows
+
+    def matrices(self):
+        """Return constraint matrices and right-hand sides.
+
+        Returns:
+            (A_eq, b_eq, A_ub, b_ub) tuple with sparse matrices A_eq, A_ub
+        """
+        from scipy.sparse import coo_matrix
+
+        result = []
+        for sense in ('==', '<='):
+            rows, columns, values = (np.concatenate(v) if v else np.zeros(0)
+                                     for v in self._coo[sense])
+            matrix = coo_matrix(
+                (values, (rows, columns)),
+                shape=(self._rows[sense], self.num_cols)).tocsr()
+            rhs = (np.concatenate(self._rhs[sense]) if self._rhs[sense]
+                   else np.zeros(0))
+            result.extend([matrix, rhs])
+        return tuple(result)
+
+    def solve(self, **options):
+        """Solve with the HiGHS solver of scipy.optimize.linprog.
+
+        Args:
+            **options: solver options, passed on to linprog
+
+        Returns:
+            array of variable values
+        """
+        from scipy.optimize import linprog
+
+        A_eq, b_eq, A_ub, b_ub = self.matrices()
+        result = linprog(self.c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq,
+                         bounds=np.column_stack([self.lb, self.ub]),
+                         method='highs', options=options)
+        self.result = result
+        if result.status != 0:
+            raise RuntimeError(
+                "Solving linear problem failed: {}".format(result.message))
+        return result.x
+
+    def solution(self, x):
+        """Wrap solution vector x into a Solution object.
+
+        Args:
+            x: array of variable values, e.g. from linprog
+
+        Returns:
+            a Solution object with one DataFrame per variable
+        """
+        entities = {}
+        for name, (tuples, labels, timesteps, columns) in \
+                self.variables.items():
+            if timesteps is None:
+                index = pd.MultiIndex.from_tuples(tuples, names=labels) \
+                    if len(labels) > 1 else pd.Index(tuples, name=labels[0])
+            else:
+                index = pd.MultiIndex.from_tuples(
+                    [(t,) + k for t in timesteps for k in tuples],
+                    names=['t'] + labels)
+            entities[name] = pd.DataFrame(
+                {name: x[columns.ravel()]}, index=index)
+
+        # e_co_stock only exists for stock commodities in the linear problem,
+        # but for all commodities in create_model, so fill in zeros
+        commodity = self.data['commodity']
+        all_tuples = [(t,) + c for t in self.timesteps[1:]
+                      for c in commodity.index]
+        entities['e_co_stock'] = entities['e_co_stock'].reindex(
+            pd.MultiIndex.from_tuples(
+                all_tuples, names=['t', 'sit', 'com', 'com_type'])).fillna(0)
+
+        return Solution(self.data, self.timesteps, entities)
+
+
+def annuity_factor(n, i):
+    """Annuity factor formula.
+
+    Evaluates the annuity factor formula for depreciation duration
+    and interest rate. Works also well for equally sized numpy arrays
+    of values for n and i.
+    
+    Args:
+        n: depreciation period (years)
+        i: interest rate (percent, e.g. 0.06 means 6 %)
+
+    Returns:
+        Value of the expression :math:`\\frac{(1+i)^n i}{(1+i)^n - 1}`
+
+    Example:
+        >>> round(annuity_factor(20, 0.07), 5)
+        0.09439
+
+    """
+    return (1+i)**n * i / ((1+i)**n - 1)
+
+
+def commodity_balance(m, tm, sit, com):
+    """Calculate commodity balance at given timestep.
+
+    For a given commodity co and timestep tm, calculate the balance of
+    consumed (to process/storage/transmission, counts positive) and provided
+    (from process/storage/transmission, counts negative) power. Used as helper
+    function in create_model for constraints on demand and stock commodities.
+
+    Only the tuples listed in the model's incidence index m.incidence (see
+    incidence_index) for the given site and commodity are visited.
+
+    Args:
+        m: the model object
+        tm: the timestep
+        site: the site
+        com: the commodity
+
+    Returns
+        balance: net value of consumed (positive) or provided (negative) power
+
+    """
+    balance = 0
+    tuples = m.incidence.get((sit, com), EMPTY_INCIDENCE)
+    for p in tuples['pro_in']:
+        # usage as input for process increases balance
+        balance += m.e_pro_in[(tm,)+p]
+    for p in tuples['pro_out']:
+        # output from processes decreases balance
+        balance -= m.e_pro_out[(tm,)+p]
+    for t in tuples['tra_in']:
+        # exports increase balance
+        balance += m.e_tra_in[(tm,)+t]
+    for t in tuples['tra_out']:
+        # imports decrease balance
+        balance -= m.e_tra_out[(tm,)+t]
+    for s in tuples['sto']:
+        # usage as input for storage increases consumption
+        # output from storage decreases consumption
+        balance += m.e_sto_in[(tm,)+s]
+        balance -= m.e_sto_out[(tm,)+s]
+    return balance
+
+
+def stock_use(m, tm, sit, com, com_type):
+    """Return use of a stock commodity at given timestep.
+
+    Helper function for create_model: the variable e_co_stock or, in compact
+    mode, its definition commodity_balance.
+    """
+    if m.settings['compact']:
+        return commodity_balance(m, tm, sit, com)
+    return m.e_co_stock[tm, sit, com, com_type]
+
+
+def co2_emissions(m, tm, sit, pro, coin, cout):
+    """Return CO2 emissions of a process at given timestep.
+
+    Helper function for create_model: the variable co2_pro_out or, in compact
+    mode, its definition input * co2 * dt.
+    """
+    if m.settings['compact']:
+        return (m.e_pro_in[tm, sit, pro, coin, cout] *
+                m.process_dict['co2'][sit, pro, coin, cout] * m.dt)
+    return m.co2_pro_out[tm, sit, pro, coin, cout]
+
+
+def new_capacity(m, name, index):
+    """Return new capacity for a capacity variable and index tuple.
+
+    Helper function for create_model: the variable {name}_new or, in compact
+    mode, its definition total capacity - installed capacity.
+
+    Args:
+        m: the model object
+        name: name of the total capacity variable, e.g. 'cap_pro'
+        index: index tuple
+
+    Returns:
+        new capacity variable or expression
+    """
+    if m.settings['compact']:
+        table, attribute = INSTALLED_CAPACITY[name]
+        return (getattr(m, name)[index] -
+                getattr(m, table + '_dict')[attribute][index])
+    return getattr(m, name + '_new')[index]
+
+
+def incidence_index(pro_tuples, tra_tuples, sto_tuples):
+    """Index process, transmission and storage tuples by site and commodity.
+
+    Scans all tuples once and records, for each (site, commodity) pair, which
+    tuples take part in its commodity balance. This lets commodity_balance
+    visit only the relevant tuples instead of all of them for every timestep.
+
+    Args:
+        pro_tuples: (sit, pro, coin, cout) process tuples
+        tra_tuples: (sitin, sitout, tra, com) transmission tuples
+        sto_tuples: (sit, sto, com) storage tuples
+
+    Returns:
+        dict mapping (sit, com) to a dict of tuple lists with the keys
+        'pro_in' (process input), 'pro_out' (process output), 'tra_in'
+        (exports), 'tra_out' (imports) and 'sto' (storage)
+
+    Example:
+        >>> idx = incidence_index([('Mid', 'gt', 'Gas', 'Elec')],
+        ...                       [('Mid', 'North', 'hvac', 'Elec')],
+        ...                       [('Mid', 'bat', 'Elec')])
+        >>> idx['Mid', 'Gas']['pro_in']
+        [('Mid', 'gt', 'Gas', 'Elec')]
+        >>> idx['North', 'Elec']['tra_out']
+        [('Mid', 'North', 'hvac', 'Elec')]
+    """
+    index = {}
+
+    def entry(sit, com):
+        if (sit, com) not in index:
+            index[sit, com] = dict((key, []) for key in EMPTY_INCIDENCE)
+        return index[sit, com]
+
+    for p in pro_tuples:
+        entry(p[0], p[2])['pro_in'].append(p)
+        entry(p[0], p[3])['pro_out'].append(p)
+    for t in tra_tuples:
+        entry(t[0], t[3])['tra_in'].append(t)
+        entry(t[1], t[3])['tra_out'].append(t)
+    for s in sto_tuples:
+        entry(s[0], s[2])['sto'].append(s)
+    return index
+
+
+def split_columns(columns, sep='.'):
+    """Split columns by separator into MultiIndex.
+
+    Given a list of column labels containing a separator string (default: '.'),
+    derive a MulitIndex that is split at the separator string.
+
+    Args:
+        columns: list of column labels, containing the separator string
+        sep: the separator string (default: '.')
+        
+    Returns:
+        a MultiIndex corresponding to input, with levels split at separator
+
+    Example:
+        >>> split_columns(['DE.Elec', 'MA.Elec', 'NO.Wind'])
+        MultiIndex(levels=[[u'DE', u'MA', u'NO'], [u'Elec', u'Wind']],
+                   labels=[[0, 1, 2], [0, 0, 1]])
+
+    """
+    column_tuples = [tuple(col.split('.')) for col in columns]
+    return pd.MultiIndex.from_tuples(column_tuples)
+
+
+class Solution(object):
+    """Solution of an urbs problem, stored as DataFrames.
+
+    Holds input data and variable values in the same form as a solved model
+    instance, so that get_entity and all functions built on top of it
+    (get_constants, get_timeseries, report and plot) accept it in place of
+    one.
+
+    Attributes:
+        commodity, process, transmission, storage, demand, supim: input
+            DataFrames, timeseries cut down to the modelled timesteps
+        com_supim, com_stock, com_demand: sets of commodities by type
+        settings: dict with the list of modelled 'timesteps'
+        entities: dict of entity name to DataFrame, as returned by get_entity
+            for a solved model instance
+        cache: dict of derived DataFrames, filled by get_constants and
+            get_timeseries on first use
+    """
+
+    def __init__(self, data, timesteps, entities):
+        get_inputs = itemgetter(
+            "commodity", "process", "transmission", "storage",
+            "demand", "supim")
+        (self.commodity, self.process, self.transmission, self.storage,
+            demand, supim) = get_inputs(data)
+        self.demand = demand.loc[timesteps]
+        self.supim = supim.loc[timesteps]
+        self.settings = {'timesteps': timesteps}
+
+        com_tuples = self.commodity.index
+        self.com_supim = set(c[1] for c in com_tuples if c[2] == 'SupIm')
+        self.com_stock = set(c[1] for c in com_tuples if c[2] == 'Stock')
+        self.com_demand = set(c[1] for c in com_tuples if c[2] == 'Demand')
+
+        self.cache = {}
+        self.entities = dict(entities)
+        self.entities['tm'] = pd.DataFrame(
+            {'tm': 1}, index=pd.Index(timesteps[1:], name='t'))
+
+
+def extract_solution(instance):
+    """Extract all variable values of a solved model instance at once.
+
+    Converts every variable of the instance to a DataFrame only once. The
+    returned Solution can be passed to get_constants, get_timeseries, report
+    and plot instead of the instance; these functions then only slice the
+    extracted DataFrames and keep derived tables in the Solution's cache.
+
+    Args:
+        instance: a solved urbs model instance; if it already is a Solution,
+            it is returned unchanged
+
+    Returns:
+        a Solution object
+    """
+    if isinstance(instance, Solution):
+        return instance
+
+    data = dict((key, getattr(instance, key)) for key in [
+        'commodity', 'process', 'transmission', 'storage', 'demand', 'supim'])
+    entities = dict((name, get_entity(instance, name))
+                    for name in list_entities(instance, 'var').index)
+    if instance.settings.get('compact'):
+        for name in DERIVED_ENTITIES:
+            entities[name] = get_entity(instance, name)
+    return Solution(data, instance.settings['timesteps'], entities)
+
+
+def solution_key(data, timesteps, dt=1, solver='glpk', options=None):
+    """Return fingerprint of a problem for the solution cache.
+
+    The SHA-1 hash covers everything the solution depends on: the input
+    tables (demand and supim only at the modelled timesteps), timesteps, dt,
+    a hash of the urbs source code as version of the model formulation (see
+    source_hash), the solver and its options.
+
+    Args:
+        data: input dict or Scenario
+        timesteps: list of modelled timesteps
+        dt: timestep duration in hours (default: 1)
+        solver: solver name (default: 'glpk')
+        options: optional dict of solver options
+
+    Returns:
+        hexadecimal hash string
+    """
+    if isinstance(data, Scenario):
+        data = data.apply()
+    timesteps = list(timesteps)
+
+    sha = hashlib.sha1()
+    for key in ['commodity', 'process', 'transmission', 'storage',
+                'demand', 'supim']:
+        frame = data[key]
+        if key in ('demand', 'supim'):
+            frame = frame.loc[timesteps]
+        sha.update(repr((key, list(frame.index),
+                         list(frame.columns))).encode('utf-8'))
+        for column in frame.columns:
+            values = frame[column].values
+            if values.dtype.kind in 'biuf':
+                sha.update(np.ascontiguousarray(values, dtype=float).tobytes())
+            else:
+                sha.update(repr(list(values)).encode('utf-8'))
+    sha.update(repr((timesteps, float(dt), source_hash(), solver,
+                     sorted((options or {}).items()))).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def read_solution_cache(cache_dir, key, data, timesteps):
+    """Load a cached solution written by write_solution_cache.
+
+    Args:
+        cache_dir: directory of cached solutions
+        key: fingerprint of the problem, see solution_key
+        data: input dict the solution belongs to
+        timesteps: list of modelled timesteps
+
+    Returns:
+        (Solution, stats) tuple of the solution and the solve statistics
+        (see solve), or None if there is no cached solution for key or it
+        is not optimal
+    """
+    cache_file = os.path.join(cache_dir, 'solution_{}.pickle'.format(key))
+    if not os.path.exists(cache_file):
+        return None
+    cached = pd.read_pickle(cache_file)
+    if not is_optimal(cached['stats']):
+        return None
+    if isinstance(data, Scenario):
+        data = data.apply()
+    return (Solution(data, list(timesteps), cached['entities']),
+            cached['stats'])
+
+
+def is_optimal(stats):
+    """Return True if solve statistics belong to an optimal solution.
+
+    Args:
+        stats: dict of solve statistics, see solve, or None for solutions of
+            the sparse matrix backend, whose solve raises unless optimal
+
+    Returns:
+        True if stats is None or solver status is 'ok' and termination
+        condition 'optimal'
+    """
+    if stats is None:
+        return True
+    return (stats.get('status') == 'ok' and
+            stats.get('termination') == 'optimal')
+
+
+def write_solution_cache(prob, cache_dir, key, stats=None):
+    """Pickle the variable values of a solved problem to cache directory.
+
+    Only the entities of the solution are stored; input data is taken from
+    the caller of read_solution_cache, whose key guarantees it is equal.
+    Only optimal solutions should be stored (see is_optimal), as
+    read_solution_cache ignores all others.
+
+    Args:
+        prob: solved model instance or Solution
+        cache_dir: directory of cached solutions, created if needed
+        key: fingerprint of the problem, see solution_key
+        stats: optional dict of solve statistics, see solve; None for
+            solutions of solve_lp, which only returns optimal ones
+
+    Returns:
+        Nothing
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    cache_file = os.path.join(cache_dir, 'solution_{}.pickle'.format(key))
+    entities = extract_solution(prob).entities
+
+    # write to temporary file first, like write_cache
+    temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    pd.to_pickle({'entities': entities, 'stats': stats}, temp_file)
+    try:
+        os.rename(temp_file, cache_file)
+    except OSError:
+        # another process has written the same cache file in the meantime
+        os.remove(temp_file)
+
+
+def get_entity(instance, name):
+    """ Return a DataFrame for an entity in model instance.
+
+    Args:
+        instance: a Pyomo ConcreteModel instance
+        name: name of a Set, Param, Var, Constraint or Objective
+
+    Returns:
+        a single-columned Pandas DataFrame with domain as index
+    """
+    if isinstance(instance, Solution):
+        # solutions already store their entities as DataFrames
+        return instance.entities[name].copy()
+    if name in DERIVED_ENTITIES and not hasattr(instance, name):
+        # left out by compact mode of create_model
+        return _get_derived_entity(instance, name)
+
+    # retrieve entity, its type and its onset names
+    _import_pyomo()
+    entity = instance.__getattribute__(name)
+    labels = _get_onset_names(entity)
+
+    # extract values
+    if isinstance(entity, pyomo.Set):
+        # Pyomo sets don't have values, only elements
+        results = pd.DataFrame([(v, 1) for v in entity.value])
+
+        # for unconstrained sets, the column label is identical to their index
+        # hence, make index equal to entity name and append underscore to name
+        # (=the later column title) to preserve identical index names for both
+        # unconstrained supersets
+        if not labels:
+            labels = [name]
+            name = name+'_'
+
+    elif isinstance(entity, pyomo.Param):
+        if entity.dim() > 1:
+            results = pd.DataFrame([v[0]+(v[1],) for v in entity.iteritems()])
+        else:
+            results = pd.DataFrame(entity.iteritems())
+    else:
+        # create DataFrame
+        if entity.dim() > 1:
+            # concatenate index tuples with value if entity has
+            # multidimensional indices v[0]
+            results = pd.DataFrame(
+                [v[0]+(v[1].value,) for v in entity.iteritems()])
+        else:
+            # otherwise, create tuple from scalar index v[0]
+            results = pd.DataFrame(
+                [(v[0], v[1].value) for v in entity.iteritems()])
+
+    # check for duplicate onset names and append one to several "_" to make
+    # them unique, e.g. ['sit', 'sit', 'com'] becomes ['sit', 'sit_', 'com']
+    for k, label in enumerate(labels):
+        if label in labels[:k]:
+            labels[k] = labels[k] + "_"
+
+    # name columns according to labels + entity name
+    results.columns = labels + [name]
+    results.set_index(labels, inplace=True)
+
+    return results
+
+
+def _get_derived_entity(instance, name):
+    """Calculate value of a variable left out by compact mode.
+
+    Args:
+        instance: a solved urbs model instance created with compact=True
+        name: one of DERIVED_ENTITIES
+
+    Returns:
+        a DataFrame like get_entity would return for the variable
+    """
+    if name.endswith('_new'):
+        # new capacity = total capacity - installed capacity
+        total = name[:-len('_new')]
+        table, attribute = INSTALLED_CAPACITY[total]
+        cap = get_entity(instance, total)
+        installed = getattr(instance, table)[attribute]
+        cap[name] = cap[total] - installed.reindex(cap.index).values
+        return cap[[name]]
+
+    elif name == 'co2_pro_out':
+        # co2 = input * co2 * dt
+        e_pro_in = get_entity(instance, 'e_pro_in')
+        co2 = instance.process['co2'].reindex(
+            e_pro_in.index.droplevel(0)).values
+        e_pro_in[name] = (e_pro_in['e_pro_in'] * co2 *
+                          instance.settings['dt'])
+        return e_pro_in[[name]]
+
+    elif name == 'e_co_stock':
+        # stock use = commodity_balance, summed up like in commodity_balance
+        terms = [('e_pro_in', ['t', 'sit', 'com'], 1),
+                 ('e_pro_out', ['t', 'sit', 'com_'], -1),
+                 ('e_tra_in', ['t', 'sit', 'com'], 1),
+                 ('e_tra_out', ['t', 'sit_', 'com'], -1),
+                 ('e_sto_in', ['t', 'sit', 'com'], 1),
+                 ('e_sto_out', ['t', 'sit', 'com'], -1)]
+        flows = []
+        for entity, levels, sign in terms:
+            flow = get_entity(instance, entity)[entity]
+            flow = flow.groupby(level=levels).sum() * sign
+            flow.index.names = ['t', 'sit', 'com']
+            flows.append(flow)
+        balance = pd.concat(flows).groupby(level=['t', 'sit', 'com']).sum()
+
+        com_stock = set(c[1] for c in instance.commodity.index
+                        if c[2] == 'Stock')
+        index = pd.MultiIndex.from_tuples(
+            [(t,) + c for t in instance.settings['timesteps'][1:]
+             for c in instance.commodity.index],
+            names=['t', 'sit', 'com', 'com_type'])
+        values = [balance.get((t, sit, com), 0) if com in com_stock else 0
+                  for t, sit, com, com_type in index]
+        return pd.DataFrame({name: values}, index=index)
+
+    else:
+        raise ValueError("Unknown derived entity '{}'".format(name))
+
+
+def get_entities(instance, names):
+    """ Return one DataFrame with entities in columns and a common index.
+
+    Works only on entities that share a common domain (set or set_tuple), which
+    is used as index of the returned DataFrame.
+
+    Args:
+        instance: a Pyomo ConcreteModel instance
+        names: list of entity names (as returned by list_entities)
 
     Returns:
         a Pandas DataFrame with entities as columns and domains as index
@@ -902,6 +3476,7 @@ def list_entities(instance, entity_type):
         [1 rows x 2 columns]
 
     """
+    _import_pyomo()
 
     # helper function to discern entities by type
     def filter_by_type(entity, entity_type):
@@ -944,6 +3519,7 @@ def _get_onset_names(entity):
             ['t', 'sit', 'com', 'com_type']
     """
     # get column titles for entities from domain set names
+    _import_pyomo()
     labels = []
 
     if isinstance(entity, pyomo.Set):
@@ -1008,6 +3584,9 @@ def get_constants(instance):
         ...     ('Global', 'CO2', 'Env'), 'max']
         True
     """
+    if isinstance(instance, Solution) and 'constants' in instance.cache:
+        return tuple(df.copy() for df in instance.cache['constants'])
+
     costs = get_entity(instance, 'costs')
     cpro = get_entities(instance, ['cap_pro', 'cap_pro_new'])
     ctra = get_entities(instance, ['cap_tra', 'cap_tra_new'])
@@ -1029,7 +3608,10 @@ def get_constants(instance):
     ctra.index.names = ['sitin', 'sitout', 'tra', 'com']
     co2.index.names = ['sit', 'pro', 'coin', 'cout']
 
-    return costs, cpro, ctra, csto, co2
+    constants = (costs, cpro, ctra, csto, co2)
+    if isinstance(instance, Solution):
+        instance.cache['constants'] = tuple(df.copy() for df in constants)
+    return constants
 
 
 def get_timeseries(instance, com, sit, timesteps=None):
@@ -1066,8 +3648,10 @@ def get_timeseries(instance, com, sit, timesteps=None):
         demand = instance.demand.loc[timesteps][sit, com]
     demand.name = 'Demand'
 
+    # get grouped timeseries of all commodities and sites
+    eco, epro, etra, esto = _get_grouped_timeseries(instance)
+
     # STOCK
-    eco = get_entity(instance, 'e_co_stock')['e_co_stock'].unstack()['Stock']
     eco = eco.xs(sit, level='sit').unstack().fillna(0)
     try:
         stock = eco.loc[timesteps][com]
@@ -1076,12 +3660,8 @@ def get_timeseries(instance, com, sit, timesteps=None):
     stock.name = 'Stock'
 
     # PROCESS
-    # group process energies by input/output commodity
     # select all entries of created and consumed desired commodity co
     # and slice to the desired timesteps
-    epro = get_entities(instance, ['e_pro_in', 'e_pro_out'])
-    epro.index.names = ['tm', 'sit', 'pro', 'coin', 'cout']
-    epro = epro.groupby(level=['tm', 'sit', 'coin', 'cout']).sum()
     epro = epro.xs(sit, level='sit')
     try:
         created = epro.xs(com, level='cout')['e_pro_out'].unstack()
@@ -1100,19 +3680,13 @@ def get_timeseries(instance, com, sit, timesteps=None):
         created.pop('Slack')
 
     # TRANSMISSION
-    etra = get_entities(instance, ['e_tra_in', 'e_tra_out'])
-    etra.index.names = ['tm', 'sitin', 'sitout', 'tra', 'com']
-    etra = etra.groupby(level=['tm', 'sitin', 'sitout', 'com']).sum()
     etra = etra.xs(com, level='com')
 
     imported = etra.xs(sit, level='sitout')['e_tra_out'].unstack()
     exported = etra.xs(sit, level='sitin')['e_tra_in'].unstack()
 
     # STORAGE
-    # group storage energies by commodity
     # select all entries with desired commodity co
-    esto = get_entities(instance, ['e_sto_con', 'e_sto_in', 'e_sto_out'])
-    esto = esto.groupby(level=['t', 'sit', 'com']).sum()
     esto = esto.xs(sit, level='sit')
     try:
         stored = esto.xs(com, level='com')
@@ -1131,19 +3705,272 @@ def get_timeseries(instance, com, sit, timesteps=None):
     return created, consumed, stored, imported, exported
 
 
-def report(instance, filename, commodities, sites):
+def _get_grouped_timeseries(instance):
+    """Return timeseries of all commodities and sites, grouped for slicing.
+
+    Helper function for get_timeseries. For a Solution, the result is kept in
+    its cache, so that later calls for other commodities and sites only need
+    to slice it.
+
+    Args:
+        instance: a urbs model instance or Solution
+
+    Returns:
+        (eco, epro, etra, esto) tuple of DataFrames: stock commodity use,
+        process input/output grouped by (tm, sit, coin, cout), transmission
+        input/output grouped by (tm, sitin, sitout, com) and storage
+        content/input/output grouped by (t, sit, com)
+    """
+    if isinstance(instance, Solution) and 'timeseries' in instance.cache:
+        return instance.cache['timeseries']
+
+    # STOCK
+    eco = get_entity(instance, 'e_co_stock')['e_co_stock'].unstack()['Stock']
+
+    # PROCESS
+    # group process energies by input/output commodity
+    epro = get_entities(instance, ['e_pro_in', 'e_pro_out'])
+    epro.index.names = ['tm', 'sit', 'pro', 'coin', 'cout']
+    epro = epro.groupby(level=['tm', 'sit', 'coin', 'cout']).sum()
+
+    # TRANSMISSION
+    etra = get_entities(instance, ['e_tra_in', 'e_tra_out'])
+    etra.index.names = ['tm', 'sitin', 'sitout', 'tra', 'com']
+    etra = etra.groupby(level=['tm', 'sitin', 'sitout', 'com']).sum()
+
+    # STORAGE
+    # group storage energies by commodity
+    esto = get_entities(instance, ['e_sto_con', 'e_sto_in', 'e_sto_out'])
+    esto = esto.groupby(level=['t', 'sit', 'com']).sum()
+
+    grouped = (eco, epro, etra, esto)
+    if isinstance(instance, Solution):
+        instance.cache['timeseries'] = grouped
+    return grouped
+
+
+def run_scenarios(filename, scenarios, timesteps, workers=None, **kwargs):
+    """Run read, create, solve, report and plot for a list of scenarios.
+
+    Each scenario is run by run_scenario in a separate worker process. A
+    failing scenario does not stop the others; its error message is recorded
+    in the returned summary instead.
+
+    Scenario functions must be picklable, i.e. defined at module level. On
+    Windows, calling scripts must guard their main code by
+    ``if __name__ == '__main__':`` for worker processes to start.
+
+    Args:
+        filename: Excel spreadsheet filename, passed to read_excel
+        scenarios: list of scenario functions, each taking and returning an
+            input dict (see runme.py)
+        timesteps: list of modelled timesteps
+        workers: number of worker processes (default: number of CPUs);
+            1 runs all scenarios in the current process
+        **kwargs: further keyword arguments to run_scenario
+
+    Returns:
+        a DataFrame with scenario names as index and status, error message
+        and stage durations (in seconds) as columns
+    """
+    run = partial(_run_scenario_safely, filename,
+                  timesteps=timesteps, **kwargs)
+    if workers == 1:
+        rows = [run(scenario) for scenario in scenarios]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            rows = pool.map(run, scenarios, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    summary = pd.DataFrame(rows, columns=SCENARIO_SUMMARY_COLUMNS)
+    summary.set_index('scenario', inplace=True)
+    return summary
+
+
+def run_scenario(filename, scenario, timesteps, dt=1, solver='glpk',
+                 result_dir='results', commodities=None, sites=None,
+                 report_format='xlsx', plot_formats=('png', 'pdf'),
+                 cache_dir=None, timings=None, profile=False,
+                 plot_workers=1, solver_options=None, solve_callback=None,
+                 database=None, solve_cache=None):
+    """Read, create, solve, report and plot a single scenario.
+
+    Performs the steps of the example script runme.py for one scenario. The
+    report and figures are saved to result_dir, using the scenario function
+    name and a timestamp in their filenames. The solver log and its
+    statistics (see solve) are saved there as well. Input is checked by
+    validate first; problems found raise a ValueError before the model is
+    built.
+
+    Args:
+        filename: Excel spreadsheet filename, passed to read_excel
+        scenario: scenario function, taking and returning an input dict
+        timesteps: list of modelled timesteps
+        dt: timestep duration in hours (default: 1)
+        solver: solver name for SolverFactory (default: 'glpk')
+        result_dir: directory for report and figures (default: 'results')
+        commodities: commodities to report (default: all demand commodities)
+        sites: sites to report (default: all sites with demand)
+        report_format: report file extension, 'xlsx' or 'h5' (default:
+            'xlsx'); if empty, no report is written
+        plot_formats: figure file extensions (default: png, pdf); if empty,
+            no plots are created
+        cache_dir: optional cache directory, passed to read_excel
+        timings: optional dict, filled with the duration of each stage in
+            seconds while it runs
+        profile: if True, save the model build profile of profile_model as
+            CSV file to result_dir
+        plot_workers: number of processes for plot_all (default: 1, as
+            run_scenarios already runs scenarios in worker processes)
+        solver_options: optional dict of solver options, passed to solve
+        solve_callback: optional progress callback, passed to solve; must
+            be picklable (defined at module level) for run_scenarios
+        database: optional SQLite database filename; if given, the report
+            tables are also added to it (see report_sql), even if
+            report_format is empty
+        solve_cache: optional directory of cached solutions; if it holds
+            the solution of an identical problem (see solution_key), model
+            creation and solve are skipped and no solver log is written;
+            only optimal solutions are added to it
+
+    Returns:
+        a Solution of the solved problem, see extract_solution
+    """
+    if timings is None:
+        timings = {}
+    sce = scenario.__name__
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M')
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+
+    # read and modify data for scenario
+    start = time.time()
+    data = read_excel(filename, cache_dir=cache_dir, timesteps=timesteps)
+    data = scenario(data)
+    problems = validate(data, timesteps)
+    if problems:
+        raise ValueError("Invalid input for {}:\n{}".format(
+            sce, '\n'.join(problems)))
+    timings['read'] = time.time() - start
+
+    # look up solution of an identical problem
+    cached = None
+    if solve_cache:
+        key = solution_key(data, timesteps, dt, solver, solver_options)
+        cached = read_solution_cache(solve_cache, key, data, timesteps)
+    if cached is not None:
+        prob, solve_stats = cached
+        profile = False
+        timings['model'] = timings['solve'] = 0.0
+    else:
+        # create model
+        start = time.time()
+        if profile:
+            prob, build_profile = profile_model(data, timesteps, dt=dt)
+        else:
+            model = create_model(data, timesteps, dt)
+            prob = model.create()
+        timings['model'] = time.time() - start
+
+        # solve it, read results
+        start = time.time()
+        solve_stats = solve(
+            prob, solver, solver_options, solve_callback, tee=False,
+            logfile=os.path.join(result_dir, '{}-solver_{}.log').format(
+                sce, timestamp))
+        prob = extract_solution(prob)
+        if solve_cache and is_optimal(solve_stats):
+            write_solution_cache(prob, solve_cache, key, solve_stats)
+        timings['solve'] = time.time() - start
+
+    # write report to spreadsheet
+    start = time.time()
+    if commodities is None:
+        commodities = sorted(set(com for sit, com in prob.demand.columns))
+    if sites is None:
+        sites = sorted(set(sit for sit, com in prob.demand.columns))
+    if report_format:
+        report(prob, os.path.join(result_dir, '{}_{}.{}').format(
+            sce, timestamp, report_format), commodities, sites,
+            database=database, scenario=sce, run=timestamp)
+    elif database:
+        report_sql(prob, database, sce, commodities, sites, timestamp)
+    if profile:
+        build_profile.to_csv(os.path.join(
+            result_dir, '{}-profile_{}.csv').format(sce, timestamp))
+    pd.DataFrame([solve_stats], index=[sce],
+                 columns=SOLVE_STATS_COLUMNS).to_csv(os.path.join(
+                     result_dir, '{}-solve_{}.csv').format(sce, timestamp))
+    timings['report'] = time.time() - start
+
+    # create timeseries plot for each demand (site, commodity) timeseries
+    # with the scenario name as figure title
+    start = time.time()
+    if plot_formats:
+        nice_sce_name = sce.replace('_', ' ').title()
+        plot_all(prob,
+                 os.path.join(result_dir, sce + '-{com}-{sit}_' +
+                              timestamp + '.{ext}'),
+                 formats=plot_formats,
+                 title=nice_sce_name + ': {com} in {sit}',
+                 workers=plot_workers)
+    timings['plot'] = time.time() - start
+
+    return prob
+
+
+def _run_scenario_safely(filename, scenario, **kwargs):
+    """Call run_scenario and catch any error; helper for run_scenarios.
+
+    Returns:
+        a row (tuple) for the summary DataFrame of run_scenarios
+    """
+    timings = {}
+    start = time.time()
+    try:
+        run_scenario(filename, scenario, timings=timings, **kwargs)
+        status, error = 'ok', ''
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+    timings['total'] = time.time() - start
+    stages = SCENARIO_SUMMARY_COLUMNS[3:]
+    return ((scenario.__name__, status, error) +
+            tuple(timings.get(stage, float('nan')) for stage in stages))
+
+
+def report(instance, filename, commodities, sites, database=None,
+           scenario=None, run=None):
     """Write result summary to a spreadsheet file
 
+    If filename ends with '.h5' or '.hdf5', the summary is written to a
+    compressed HDF5 file instead (see report_hdf). If database is given, the
+    summary tables are also added to that SQLite result store (see
+    report_sql).
+
     Args:
         instance: a urbs model instance
         filename: Excel spreadsheet filename, will be overwritten if exists
         commodities: list of commodities for which to create timeseries sheets
         sites: list of sites
+        database: optional SQLite database filename
+        scenario: scenario name in database (default: basename of filename)
+        run: run timestamp in database (default: now)
 
     Returns:
         Nothing
     """
+    if database is not None:
+        if scenario is None:
+            scenario = os.path.splitext(os.path.basename(filename))[0]
+        report_sql(instance, database, scenario, commodities, sites, run)
+    if os.path.splitext(filename)[1] in HDF_EXTENSIONS:
+        return report_hdf(instance, filename, commodities, sites)
+
     # get the data
+    instance = extract_solution(instance)
     costs, cpro, ctra, csto, co2 = get_constants(instance)
 
     # create spreadsheet writer object
@@ -1163,31 +3990,8 @@ def report(instance, filename, commodities, sites):
         # collect timeseries data
         for co in commodities:
             for sit in sites:
-                created, consumed, stored, imported, exported = get_timeseries(
-                    instance, co, sit)
-
-                overprod = pd.DataFrame(
-                    columns=['Overproduction'],
-                    data=created.sum(axis=1) - consumed.sum(axis=1) +
-                    imported.sum(axis=1) - exported.sum(axis=1) +
-                    stored['Retrieved'] - stored['Stored'])
-
-                tableau = pd.concat(
-                    [created, consumed, stored, imported, exported, overprod],
-                    axis=1,
-                    keys=['Created', 'Consumed', 'Storage',
-                          'Import from', 'Export to', 'Balance'])
-                timeseries[(co, sit)] = tableau.copy()
-
-                # timeseries sums
-                sums = pd.concat([created.sum(),
-                                  consumed.sum(),
-                                  stored.sum().drop('Level'),
-                                  imported.sum(),
-                                  exported.sum(),
-                                  overprod.sum()], axis=0,
-                                 keys=['Created', 'Consumed', 'Storage',
-                                 'Import', 'Export', 'Balance'])
+                tableau, sums = get_tableau(instance, co, sit)
+                timeseries[(co, sit)] = tableau
                 energies.append(sums.to_frame("{}.{}".format(co, sit)))
 
         # concatenate energy sums
@@ -1201,6 +4005,184 @@ def report(instance, filename, commodities, sites):
                 timeseries[(co, sit)].to_excel(writer, sheet_name)
 
 
+def report_hdf(instance, filename, commodities, sites):
+    """Write result summary to a compressed HDF5 file
+
+    Writes the same tables as report, each to its own node in table format,
+    so that single columns can be read without loading the whole file, e.g.
+    by pd.read_hdf(filename, 'energy_sums', columns=['Elec.Mid']). Nodes are
+    'costs', 'co2', 'process_caps', 'transmission_caps', 'storage_caps',
+    'energy_sums' and 'timeseries/{commodity}/{site}'. The two-level column
+    titles of the timeseries tableaus are joined by a dot, so that e.g.
+    ('Created', 'Wind') becomes 'Created.Wind'.
+
+    Requires the package PyTables.
+
+    Args:
+        instance: a urbs model instance
+        filename: HDF5 filename, will be overwritten if exists
+        commodities: list of commodities for which to write timeseries
+        sites: list of sites
+
+    Returns:
+        Nothing
+    """
+    # get the data
+    instance = extract_solution(instance)
+    costs, cpro, ctra, csto, co2 = get_constants(instance)
+
+    store = pd.HDFStore(filename, mode='w', complevel=9, complib='blosc')
+    try:
+        # write constants
+        store.put('costs', costs, format='table')
+        store.put('co2', co2.to_frame('CO2'), format='table')
+        store.put('process_caps', cpro, format='table')
+        store.put('transmission_caps', ctra, format='table')
+        store.put('storage_caps', csto, format='table')
+
+        # write timeseries and collect energy sums
+        energies = []
+        for co in commodities:
+            for sit in sites:
+                tableau, sums = get_tableau(instance, co, sit)
+                tableau.columns = ['.'.join(col) for col in tableau.columns]
+                store.put('timeseries/{}/{}'.format(co, sit), tableau,
+                          format='table')
+                energies.append(sums.to_frame("{}.{}".format(co, sit)))
+
+        # concatenate energy sums
+        energy = pd.concat(energies, axis=1).fillna(0)
+        store.put('energy_sums', energy, format='table')
+    finally:
+        store.close()
+
+
+def report_sql(instance, database, scenario, commodities, sites, run=None):
+    """Add result summary to a SQLite result store
+
+    Writes costs, capacities, emissions and energy sums in long format, one
+    row per value, to the tables listed in SQL_TABLES. Every row starts with
+    the scenario name and the run timestamp, which are indexed together with
+    all site and commodity columns, so that results of many runs can be
+    compared by queries instead of reading each report file. Rows of an
+    earlier report with the same scenario and run are replaced. Tables and
+    indices are created if the database is new.
+
+    Args:
+        instance: a urbs model instance
+        database: SQLite database filename
+        scenario: scenario name
+        commodities: list of commodities for which to write energy sums
+        sites: list of sites
+        run: run timestamp (default: now), formatted like in run_scenario
+            so that the latest run sorts last
+
+    Returns:
+        Nothing
+
+    Example:
+        >>> report_sql(prob, 'results/urbs.sqlite', 'scenario_base',
+        ...            ['Elec'], ['Mid'])
+        >>> con = sqlite3.connect('results/urbs.sqlite')
+        >>> pd.read_sql_query("SELECT run, cost_type, value FROM costs "
+        ...                   "WHERE scenario = 'scenario_base'", con)
+    """
+    if run is None:
+        run = datetime.now().strftime('%Y-%m-%d_%H-%M')
+
+    # get the data
+    instance = extract_solution(instance)
+    costs, cpro, ctra, csto, co2 = get_constants(instance)
+    energies = []
+    for co in commodities:
+        for sit in sites:
+            _, sums = get_tableau(instance, co, sit)
+            sums.index = pd.MultiIndex.from_tuples(
+                [(sit, co) + key for key in sums.index])
+            energies.append(sums)
+    tables = {
+        'costs': costs,
+        'process_caps': cpro,
+        'transmission_caps': ctra,
+        'storage_caps': csto,
+        'emissions': co2.to_frame(),
+        'energy_sums': pd.concat(energies).to_frame()}
+
+    con = sqlite3.connect(database, timeout=60)
+    try:
+        with con:
+            for table, keys, values in SQL_TABLES:
+                columns = ['scenario', 'run'] + keys + values
+                con.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                    table, ', '.join(
+                        '{} {}'.format(col, 'REAL' if col in values
+                                       else 'TEXT') for col in columns)))
+                con.execute('CREATE INDEX IF NOT EXISTS {0}_run '
+                            'ON {0} (scenario, run)'.format(table))
+                for col in keys:
+                    if col.startswith(('site', 'commodity')):
+                        con.execute('CREATE INDEX IF NOT EXISTS {0}_{1} '
+                                    'ON {0} ({1})'.format(table, col))
+
+                # replace rows of the same scenario and run
+                con.execute('DELETE FROM {} WHERE scenario = ? AND run = ?'
+                            .format(table), (scenario, run))
+                frame = tables[table]
+                rows = []
+                for key, row in zip(frame.index, frame.values):
+                    if not isinstance(key, tuple):
+                        key = (key,)
+                    rows.append((scenario, run) + key +
+                                tuple(float(value) for value in row))
+                con.executemany('INSERT INTO {} VALUES ({})'.format(
+                    table, ', '.join('?' * len(columns))), rows)
+    finally:
+        con.close()
+
+
+def get_tableau(instance, com, sit):
+    """Return timeseries tableau and energy sums for commodity and site.
+
+    Collects all timeseries from get_timeseries in one DataFrame and adds the
+    overproduction, i.e. the balance of all inputs and outputs. Used by
+    report for the timeseries sheets and the energy sums.
+
+    Args:
+        instance: a urbs model instance
+        com: a commodity
+        sit: a site
+
+    Returns:
+        (tableau, sums) tuple of a DataFrame with two-level column titles
+        and a Series of the timeseries sums over time
+    """
+    created, consumed, stored, imported, exported = get_timeseries(
+        instance, com, sit)
+
+    overprod = pd.DataFrame(
+        columns=['Overproduction'],
+        data=created.sum(axis=1) - consumed.sum(axis=1) +
+        imported.sum(axis=1) - exported.sum(axis=1) +
+        stored['Retrieved'] - stored['Stored'])
+
+    tableau = pd.concat(
+        [created, consumed, stored, imported, exported, overprod],
+        axis=1,
+        keys=['Created', 'Consumed', 'Storage',
+              'Import from', 'Export to', 'Balance'])
+
+    # timeseries sums
+    sums = pd.concat([created.sum(),
+                      consumed.sum(),
+                      stored.sum().drop('Level'),
+                      imported.sum(),
+                      exported.sum(),
+                      overprod.sum()], axis=0,
+                     keys=['Created', 'Consumed', 'Storage',
+                           'Import', 'Export', 'Balance'])
+    return tableau, sums
+
+
 def plot(prob, com, sit, timesteps=None):
     """Plot a stacked timeseries of commodity balance and storage.
 
@@ -1216,17 +4198,29 @@ def plot(prob, com, sit, timesteps=None):
     Returns:
         fig: figure handle
     """
-    import matplotlib.pyplot as plt
-    import matplotlib as mpl
+    return plot_data(get_plot_data(prob, com, sit, timesteps))
+
+
+def get_plot_data(prob, com, sit, timesteps=None):
+    """Extract all data needed by plot_data for one commodity and site.
+
+    Args:
+        prob: urbs model instance or Solution
+        com: commodity name to plot
+        sit: site name to plot
+        timesteps: optional list of  timesteps to plot; default: prob.tm
+
+    Returns:
+        dict with the keys 'created', 'consumed' (DataFrames of stacked
+        timeseries), 'demand', 'stored' (Series), 'storage_capacity',
+        'timesteps' and 'title'
+    """
+    prob = extract_solution(prob)
 
     if timesteps is None:
         # default to all simulated timesteps
         timesteps = sorted(get_entity(prob, 'tm').index)
 
-    # FIGURE
-    fig = plt.figure(figsize=(16, 8))
-    gs = mpl.gridspec.GridSpec(2, 1, height_ratios=[2, 1])
-
     created, consumed, stored, imported, exported = get_timeseries(
         prob, com, sit, timesteps)
 
@@ -1256,6 +4250,40 @@ def plot(prob, com, sit, timesteps=None):
             if col not in consumed.columns or not consumed[col].any():
                 created.pop(col)
 
+    return {
+        'created': created,
+        'consumed': consumed,
+        'demand': demand,
+        'stored': stored,
+        'storage_capacity': csto.loc[sit, :, com]['C Total'].sum(),
+        'timesteps': timesteps,
+        'title': 'Energy balance of {} in {}'.format(com, sit)}
+
+
+def plot_data(data):
+    """Plot a stacked timeseries of commodity balance and storage.
+
+    Rendering part of plot, working only on data extracted by get_plot_data.
+
+    Args:
+        data: dict as returned by get_plot_data
+
+    Returns:
+        fig: figure handle
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+
+    created = data['created']
+    consumed = data['consumed']
+    demand = data['demand']
+    stored = data['stored']
+    timesteps = data['timesteps']
+
+    # FIGURE
+    fig = plt.figure(figsize=(16, 8))
+    gs = mpl.gridspec.GridSpec(2, 1, height_ratios=[2, 1])
+
     # PLOT CREATED
     ax0 = plt.subplot(gs[0])
     sp0 = ax0.stackplot(created.index, created.as_matrix().T, linewidth=0.15)
@@ -1276,7 +4304,7 @@ def plot(prob, com, sit, timesteps=None):
             (0, 0), 0, 0, facecolor=commodity_color))
 
     # label
-    ax0.set_title('Energy balance of {} in {}'.format(com, sit))
+    ax0.set_title(data['title'])
     ax0.set_ylabel('Power (MW)')
 
     # legend
@@ -1316,7 +4344,7 @@ def plot(prob, com, sit, timesteps=None):
     # labels & y-limits
     ax1.set_xlabel('Time in year (h)')
     ax1.set_ylabel('Energy (MWh)')
-    ax1.set_ylim((0, csto.loc[sit, :, com]['C Total'].sum()))
+    ax1.set_ylim((0, data['storage_capacity']))
 
     # make xtick distance duration-dependent
     if len(timesteps) > 26*168:
@@ -1352,6 +4380,89 @@ def plot(prob, com, sit, timesteps=None):
     return fig
 
 
+def plot_all(prob, filename, plots=None, formats=('png', 'pdf'),
+             title=None, timesteps=None, workers=None):
+    """Plot several commodity/site combinations in parallel and save them.
+
+    All data is extracted from prob once in the calling process (see
+    get_plot_data). The figures are then rendered and saved by a pool of
+    worker processes with the non-interactive Agg backend, or in the calling
+    process without changing its backend if workers is 1.
+
+    Args:
+        prob: urbs model instance or Solution
+        filename: filename pattern with the fields {com}, {sit} and {ext},
+            e.g. 'results/plot-{com}-{sit}.{ext}'
+        plots: list of (com, sit) tuples (default: all demand timeseries)
+        formats: list of file extensions (default: png, pdf)
+        title: optional title pattern with the fields {com} and {sit}
+            (default: 'Energy balance of {com} in {sit}')
+        timesteps: optional list of timesteps to plot (default: all)
+        workers: number of worker processes (default: number of CPUs); 1
+            renders all figures in the current process with its current
+            backend
+
+    Returns:
+        list of saved filenames
+
+    Example:
+        >>> plot_all(prob, 'results/plot-{com}-{sit}.{ext}', workers=4)
+    """
+    prob = extract_solution(prob)
+    if plots is None:
+        plots = [(com, sit) for sit, com in prob.demand.columns]
+
+    jobs = []
+    for com, sit in plots:
+        data = get_plot_data(prob, com, sit, timesteps)
+        if title is not None:
+            data['title'] = title.format(com=com, sit=sit)
+        filenames = [filename.format(com=com, sit=sit, ext=ext)
+                     for ext in formats]
+        jobs.append((data, filenames, dict(COLORS)))
+
+    if workers == 1:
+        saved = [_save_plot(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_plot_worker)
+        try:
+            saved = pool.map(_save_plot, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [f for filenames in saved for f in filenames]
+
+
+def _init_plot_worker():
+    """Select the non-interactive Agg backend in a plot_all worker."""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _save_plot(job):
+    """Render one figure and save it; helper for plot_all.
+
+    Uses the current matplotlib backend, which is Agg in worker processes
+    (see _init_plot_worker) and left unchanged in the calling process.
+
+    Args:
+        job: (data, filenames, colors) tuple of plot data, list of
+            filenames and COLORS of the calling process
+
+    Returns:
+        list of saved filenames
+    """
+    import matplotlib.pyplot as plt
+
+    data, filenames, colors = job
+    COLORS.update(colors)
+    fig = plot_data(data)
+    for fig_filename in filenames:
+        fig.savefig(fig_filename, bbox_inches='tight')
+    plt.close(fig)
+    return filenames
+
+
 def to_color(obj=None):
     """Assign a deterministic pseudo-random color to argument.
 